@@ -0,0 +1,323 @@
+"""
+Benchmarks for the rendering and economy hot paths of "A solar system".
+Runs without a window (SDL_VIDEODRIVER=dummy) and writes the time per
+call of each benchmark as JSON. Given a baseline file from an earlier
+run, it also reports how much slower or faster each benchmark got, and
+exits with status 1 if any got slower than the allowed ratio.
+
+    python bench.py [--sizes 10,100,1000] [--output results.json]
+                    [--baseline baseline.json] [--threshold 1.25]
+"""
+
+import os
+
+# The dummy video driver has to be chosen before pygame is initialized
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+
+import argparse
+import json
+import platform
+import random
+import sys
+import timeit
+import pygame
+import buildings
+import catalog
+import simulation
+import solar
+import ui
+
+
+DEFAULT_SIZES = [10, 100, 1000, 4000]
+
+def measure(setup, number, repeat=3):
+    """
+    setup: function
+    number: int
+    repeat: int
+    Calls setup() to get a function, then times calling that function
+        number times (with the call count, 0 to number - 1).
+    This is repeated, with a fresh setup, repeat times.
+    Returns the best time per call, in seconds.
+    Returns a float.
+    """
+    best = None
+
+    for i in range(repeat):
+        function = setup()
+
+        start = timeit.default_timer()
+
+        for n in range(number):
+            function(n)
+
+        elapsed = (timeit.default_timer() - start) / number
+
+        if best is None or elapsed < best:
+            best = elapsed
+
+    return best
+
+
+def make_grid(size):
+    """
+    size: int
+    Makes a size x size grid the way Game does: a plain Grid for 10x10
+        and a sparse ScrollingGrid for anything larger.
+    Returns a Grid object.
+    """
+    if size <= 10:
+        return ui.Grid(size, size, x=100, color=(25, 25, 25), border=1,
+                fill=(0, 0, 0), images=buildings.get_image)
+
+    return ui.ScrollingGrid(size, size, 500, 500, x=100, color=(25, 25, 25),
+            border=1, fill=(0, 0, 0), images=buildings.get_image,
+            sparse=True)
+
+
+def free_cells(size, number, seed=0):
+    """
+    size: int
+    number: int
+    seed: int
+    Returns number distinct cells of a size x size grid, skipping the
+        starting cell, in a repeatable random order.
+    Returns a list (of tuples).
+    """
+    rng = random.Random(seed)
+    cells = set()
+    number = min(number, size * size - 1)
+    start_loc = simulation.get_start_loc(size, size)
+
+    while len(cells) < number:
+        cell = (rng.randrange(size), rng.randrange(size))
+
+        if cell != start_loc:
+            cells.add(cell)
+
+    return sorted(cells, key=lambda cell: rng.random())
+
+
+def bench_buildings():
+    """
+    Times loading an image and making each kind of building.
+    Returns a dict (of floats) by benchmark name.
+    """
+    results = {}
+
+    results['buildings.load_image'] = measure(
+            lambda: lambda n: buildings.load_image('house.png'), 10000)
+
+    for building_id, spec in sorted(catalog.BUILDINGS.items()):
+        results['buildings.make_building[%s]' % spec.key] = measure(
+                lambda: lambda n: buildings.make_building(building_id), 2000)
+
+    return results
+
+
+def bench_grid(size):
+    """
+    size: int
+    Times drawing, hit testing and adding sprites to a size x size grid.
+    Returns a dict (of floats) by benchmark name.
+    """
+    results = {}
+    label = '[%dx%d]' % (size, size)
+    surface = pygame.display.get_surface()
+
+    cells = free_cells(size, 1000)
+    sprites = [buildings.House() for cell in cells]
+
+    def setup_draw():
+        grid = make_grid(size)
+
+        for cell, sprite in zip(cells, sprites):
+            grid.add_sprite(sprite, cell)
+
+        return lambda n: grid.draw(surface)
+
+    results['Grid.draw' + label] = measure(setup_draw, 20)
+
+    grid = make_grid(size)
+    bounds = grid.get_bounds()
+    rng = random.Random(1)
+    points = [(rng.randrange(bounds.left, bounds.right),
+            rng.randrange(bounds.top, bounds.bottom)) for i in range(1000)]
+
+    results['Grid.get_loc' + label] = measure(
+            lambda: lambda n: grid.get_loc(points[n]), len(points))
+
+    def setup_add():
+        grid = make_grid(size)
+        return lambda n: grid.add_sprite(sprites[n], cells[n])
+
+    results['Grid.add_sprite' + label] = measure(setup_add, len(cells))
+
+    return results
+
+
+def bench_game(size):
+    """
+    size: int
+    Times drawing text, placing buildings and paying income in a game on
+        a size x size grid.
+    Returns a dict (of floats) by benchmark name.
+    """
+    results = {}
+    label = '[%dx%d]' % (size, size)
+
+    cells = free_cells(size, 1000)
+
+    def setup_game():
+        game = solar.Game(size, size)
+        game.simulation.start()
+        game.simulation.income = 10 ** 9
+
+        return game
+
+    game = setup_game()
+    text = game.status_bar.income
+
+    def draw_text(n):
+        game.status_bar.set_income(n)
+        game.draw_text(text)
+
+    results['Game.draw_text' + label] = measure(lambda: draw_text, 1000)
+
+    # Placing a building in the simulation and drawing its cell, which
+    # is what Game.add_building did for the grid before the grid drew
+    # from the simulation's field
+    def setup_add():
+        game = setup_game()
+        def place_building(n):
+            game.simulation.held = simulation.HOUSE
+            game.simulation.place(cells[n])
+            game.draw_cell(game.grid, cells[n])
+
+        return place_building
+
+    results['Game.place_building' + label] = measure(setup_add,
+            len(cells))
+
+    def setup_income():
+        game = setup_game()
+
+        for cell in cells:
+            game.simulation.set_cell(cell, simulation.HOUSE)
+
+        return lambda n: game.update_income()
+
+    results['Game.update_income' + label] = measure(setup_income, 1000)
+
+    return results
+
+
+def bench_text():
+    """
+    Times setting the text of a Font and formatting numbers.
+    Returns a dict (of floats) by benchmark name.
+    """
+    results = {}
+
+    font = ui.Font(None, 22, (255, 255, 255), (575, 575))
+
+    results['Font.set_text'] = measure(lambda: lambda n: font.set_text(
+            "$" + ui.make_string(n * 7919), align="right"), 2000)
+
+    results['make_string'] = measure(
+            lambda: lambda n: ui.make_string(n * 7919), 10000)
+
+    return results
+
+
+def run(sizes):
+    """
+    sizes: list (of ints)
+    Runs every benchmark.
+    Returns a dict (of floats) by benchmark name.
+    """
+    pygame.init()
+    pygame.display.set_mode((600, 600))
+    buildings.build_atlas()
+
+    results = {}
+    results.update(bench_buildings())
+    results.update(bench_text())
+
+    for size in sizes:
+        results.update(bench_grid(size))
+        results.update(bench_game(size))
+
+    return results
+
+
+def compare(results, baseline, threshold):
+    """
+    results: dict (of floats)
+    baseline: dict (of floats)
+    threshold: float
+    Prints each benchmark's time against its baseline time.
+    Returns the names of the benchmarks that are more than threshold
+        times slower than their baseline.
+    Returns a list (of strings).
+    """
+    regressions = []
+
+    for name in sorted(results):
+        if name not in baseline:
+            print("%-40s %12.3f us  (new)" % (name, results[name] * 1e6))
+            continue
+
+        ratio = results[name] / baseline[name]
+        mark = ""
+
+        if ratio > threshold:
+            mark = "  REGRESSION"
+            regressions.append(name)
+
+        print("%-40s %12.3f us  %6.2fx%s" %
+                (name, results[name] * 1e6, ratio, mark))
+
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the rendering "
+            "and economy hot paths.")
+    parser.add_argument('--sizes', default=','.join(map(str, DEFAULT_SIZES)),
+            help="comma separated grid sizes (default: %(default)s)")
+    parser.add_argument('--output', default='bench.json',
+            help="file to write results to (default: %(default)s)")
+    parser.add_argument('--baseline',
+            help="results file from an earlier run to compare against")
+    parser.add_argument('--threshold', type=float, default=1.25,
+            help="slowdown ratio counted as a regression "
+            "(default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    sizes = [int(size) for size in args.sizes.split(',')]
+    results = run(sizes)
+
+    with open(args.output, 'w') as f:
+        json.dump({
+            'python': platform.python_version(),
+            'pygame': pygame.version.ver,
+            'sizes': sizes,
+            'results': results,
+            }, f, indent=2, sort_keys=True)
+
+    baseline = {}
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+
+    regressions = compare(results, baseline, args.threshold)
+
+    pygame.quit()
+
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,11 +1,17 @@
 import pygame
 import os
+import catalog
+import ui
 
 
 class Building(pygame.sprite.Sprite):
     """
     A generic building sprite.
+    The building's rules are read from its catalog.BuildingType, which is
+        shared by every building of the same kind.
     Attributes:
+        building_id: int
+        spec: catalog.BuildingType
         name: string
         building_type: int
         cost: int
@@ -19,15 +25,25 @@ class Building(pygame.sprite.Sprite):
         get_income()
         get_power()
     """
-    def __init__(self):
+    def __init__(self, building_id=None):
         pygame.sprite.Sprite.__init__(self)
 
-        self.name = None
+        self.building_id = building_id
+
+        if building_id is None:
+            self.spec = catalog.NO_BUILDING
+            return
+
+        self.spec = catalog.BUILDINGS[building_id]
+
+        self.image = load_image(self.spec.image)
+        self.rect = self.image.get_rect()
 
-        self.building_type = 0
-        self.cost = 0
-        self.income = 0
-        self.power = 0
+    name = property(lambda self: self.spec.name)
+    building_type = property(lambda self: self.spec.building_type)
+    cost = property(lambda self: self.spec.cost)
+    income = property(lambda self: self.spec.income)
+    power = property(lambda self: self.spec.power)
 
     def get_name(self):
         """
@@ -65,111 +81,205 @@ class Building(pygame.sprite.Sprite):
         return self.power
 
 
+# The buildings the game started with, kept as names for Building with
+# their catalog ids. Their rules are in the catalog, like any other's.
+
 class SolarPanel(Building):
-    """A solar panel with cost 25 and power 10."""
+    """A solar panel."""
     def __init__(self):
-        Building.__init__(self)
-
-        self.image = load_image('solarpanel.png')
-        self.rect = self.image.get_rect()
+        Building.__init__(self, catalog.SOLAR_PANEL)
 
-        self.name = "Solar Panel"
 
-        self.building_type = 1
-        self.cost = 25
-        self.power = 10
+class House(Building):
+    """A house."""
+    def __init__(self):
+        Building.__init__(self, catalog.HOUSE)
 
 
-class House(Building):
-    """A house with income 10 and power drain 1."""
+class Factory(Building):
+    """A factory."""
     def __init__(self):
-        Building.__init__(self)
+        Building.__init__(self, catalog.FACTORY)
 
-        self.image = load_image('house.png')
-        self.rect = self.image.get_rect()
 
-        self.name = "House"
+class SolarFarm(Building):
+    """A solar farm."""
+    def __init__(self):
+        Building.__init__(self, catalog.SOLAR_FARM)
 
-        self.building_type = 2
-        self.income = 10
-        self.power = 1
 
+class Corporation(Building):
+    """A corporation."""
+    def __init__(self):
+        Building.__init__(self, catalog.CORPORATION)
 
-class Factory(Building):
-    """A building with income 500 and power drain 20."""
+
+class Sun(Building):
+    """The Sun!"""
     def __init__(self):
-        Building.__init__(self)
+        Building.__init__(self, catalog.SUN)
 
-        self.image = load_image('factory.png')
-        self.rect = self.image.get_rect()
 
-        self.name = "Factory"
+def make_building(building_id):
+    """
+    building_id: int
+    Creates a building sprite for any building id in the catalog.
+    Returns a Building object.
+    """
+    return Building(building_id)
 
-        self.building_type = 2
-        self.income = 500
-        self.power = 20
 
+def get_image(building_id):
+    """
+    building_id: int
+    Returns the image of the given building id, from the image cache.
+    Returns a pygame.Surface object.
+    """
+    return load_image(catalog.BUILDINGS[building_id].image)
 
-class SolarFarm(Building):
-    """A solar farm with cost 200 and power 100."""
-    def __init__(self):
-        Building.__init__(self)
 
-        self.image = load_image('solarfarm.png')
-        self.rect = self.image.get_rect()
+# Images shared between every building, keyed by filename.
+# Each entry is a [surface, converted] pair.
+_image_cache = {}
 
-        self.name = "Solar Farm"
+_cache_stats = {'hits': 0, 'misses': 0}
 
-        self.building_type = 1
-        self.cost = 200
-        self.power = 100
 
+def load_image(filename):
+    """
+    filename: string
+    Load the image with the given filename in the data directory
+        (catalog.DATA_DIR), wherever the game is run from.
+    Images are read from disk once and shared between all callers.
+    If a display mode has been set, the image is converted to the
+        display's pixel format the first time it is requested after that.
+    Returns a pygame.Surface object.
+    """
+    entry = _image_cache.get(filename)
 
-class Corporation(Building):
-    """A corporation with income 10000 and power drain 200."""
-    def __init__(self):
-        Building.__init__(self)
+    if entry is None:
+        _cache_stats['misses'] += 1
 
-        self.image = load_image('corporation.png')
-        self.rect = self.image.get_rect()
+        location = os.path.join(catalog.DATA_DIR, filename)
+        entry = [pygame.image.load(location), False]
+        _image_cache[filename] = entry
 
-        self.name = "Corporation"
+    else:
+        _cache_stats['hits'] += 1
 
-        self.building_type = 2
-        self.income = 10000
-        self.power = 100
+    if not entry[1] and pygame.display.get_surface() is not None:
+        entry[0] = convert_image(entry[0])
+        entry[1] = True
 
+    return entry[0]
 
-class Sun(Building):
-    """The Sun! It has power 20000 and cost 0!"""
-    def __init__(self):
-        Building.__init__(self)
 
-        self.image = load_image('sun.png')
-        self.rect = self.image.get_rect()
+def convert_image(image):
+    """
+    image: pygame.Surface
+    Converts an image to the display's pixel format, keeping per-pixel
+        alpha if the image has any.
+    Returns a pygame.Surface object.
+    """
+    if image.get_alpha() is None:
+        return image.convert()
+
+    return image.convert_alpha()
 
-        self.name = "Sun"
 
-        self.building_type = 1
-        self.cost = 0
-        self.power = 20000
+def preload_images(filenames=None):
+    """
+    filenames: list (of strings) or None
+    Loads the given images into the image cache.
+    If no filenames are given, every image in the data directory is
+        loaded.
+    """
+    if filenames is None:
+        filenames = sorted(name for name in os.listdir(catalog.DATA_DIR)
+                if name.endswith('.png'))
 
+    for filename in filenames:
+        load_image(filename)
 
-def load_image(filename):
+
+def invalidate_images(filename=None):
     """
-    filename: string
-    Load the image located at 'data/filename'.
+    filename: string or None
+    Removes an image from the image cache so that it is read from disk
+        the next time it is loaded.
+    If no filename is given, the whole cache is emptied.
+    """
+    if filename is None:
+        _image_cache.clear()
+    else:
+        _image_cache.pop(filename, None)
+
+
+def build_atlas(filenames=None, padding=1):
+    """
+    filenames: list (of strings) or None
+    padding: int
+    Packs the given images (every image in the data directory by
+        default) into a single atlas Surface, row by row from tallest to
+        shortest.
+    Each image's cache entry is replaced with a subsurface view of the
+        atlas, so every building blits from the same source Surface.
     Returns a pygame.Surface object.
     """
-    location = os.path.join('data', filename)
-    image = pygame.image.load(location)
+    if filenames is None:
+        filenames = sorted(name for name in os.listdir(catalog.DATA_DIR)
+                if name.endswith('.png'))
 
-    if __name__ != '__main__':
-        return image
+    images = [(filename,
+            pygame.image.load(os.path.join(catalog.DATA_DIR, filename)))
+            for filename in filenames]
 
-    if image.get_alpha is None:
-        image = image.convert()
-    else:
-        image = image.convert_alpha()
+    # Sort tallest first so each row wastes as little height as possible
+    images.sort(key=lambda item: item[1].get_height(), reverse=True)
+
+    area = sum((image.get_width() + padding) * (image.get_height() + padding)
+            for filename, image in images)
+    atlas_width = max([int(area ** 0.5)] +
+            [image.get_width() + padding for filename, image in images])
+
+    # Place each image at the end of the current row, or start a new row
+    regions = []
+    x = y = row_height = 0
+
+    for filename, image in images:
+        width, height = image.get_size()
+
+        if x + width > atlas_width:
+            x = 0
+            y += row_height + padding
+            row_height = 0
+
+        regions.append((filename, image, pygame.Rect(x, y, width, height)))
+
+        x += width + padding
+        row_height = max(row_height, height)
+
+    atlas = ui.pack_images((atlas_width, y + row_height),
+            [(image, rect) for filename, image, rect in regions])
+
+    converted = pygame.display.get_surface() is not None
+
+    if converted:
+        atlas = atlas.convert_alpha()
+
+    for filename, image, rect in regions:
+        _image_cache[filename] = [atlas.subsurface(rect), converted]
+
+    return atlas
+
+
+def get_cache_stats():
+    """
+    Returns the number of image cache hits and misses so far, and
+        the number of images currently cached.
+    Returns a dict.
+    """
+    stats = dict(_cache_stats)
+    stats['size'] = len(_image_cache)
 
-    return image
+    return stats
@@ -0,0 +1,189 @@
+"""
+The catalog of building types, loaded from data/buildings.csv, and the
+unlock table, loaded from data/unlocks.csv.
+There is one immutable BuildingType per kind of building, shared by
+every building of that kind, so a placed building only needs its
+building id and its position.
+"""
+
+import csv
+import os
+
+
+# Building types
+POWER = 1
+INCOME = 2
+
+TYPE_NAMES = {'power': POWER, 'income': INCOME}
+
+# Building id of an empty cell
+EMPTY = 0
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+CATALOG_FILE = os.path.join(DATA_DIR, 'buildings.csv')
+UNLOCKS_FILE = os.path.join(DATA_DIR, 'unlocks.csv')
+
+
+class BuildingType(object):
+    """
+    The rules for one kind of building. Can't be changed once made.
+    Attributes:
+        building_id: int
+        key: string
+        name: string
+        building_type: int
+        cost: int
+        income: int
+        power: int
+        image: string
+    """
+    __slots__ = ('building_id', 'key', 'name', 'building_type', 'cost',
+            'income', 'power', 'image')
+
+    def __init__(self, building_id, key, name, building_type, cost, income,
+            power, image):
+        set_attribute = object.__setattr__
+
+        set_attribute(self, 'building_id', building_id)
+        set_attribute(self, 'key', key)
+        set_attribute(self, 'name', name)
+        set_attribute(self, 'building_type', building_type)
+        set_attribute(self, 'cost', cost)
+        set_attribute(self, 'income', income)
+        set_attribute(self, 'power', power)
+        set_attribute(self, 'image', image)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("BuildingType objects can't be changed")
+
+    def __delattr__(self, name):
+        raise AttributeError("BuildingType objects can't be changed")
+
+    def __repr__(self):
+        return "BuildingType(%r, %r)" % (self.building_id, self.key)
+
+
+class Unlock(object):
+    """
+    One tier of the unlock table: the building unlocked once income
+        (and the power pool) reach the given amounts.
+    Can't be changed once made.
+    Attributes:
+        income: int
+        power: int
+        building_id: int
+        message: string
+    """
+    __slots__ = ('income', 'power', 'building_id', 'message')
+
+    def __init__(self, income, power, building_id, message):
+        set_attribute = object.__setattr__
+
+        set_attribute(self, 'income', income)
+        set_attribute(self, 'power', power)
+        set_attribute(self, 'building_id', building_id)
+        set_attribute(self, 'message', message)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Unlock objects can't be changed")
+
+    def __delattr__(self, name):
+        raise AttributeError("Unlock objects can't be changed")
+
+    def __repr__(self):
+        return "Unlock(%d, %d, %d)" % (self.income, self.power,
+                self.building_id)
+
+
+def load_catalog(filename=CATALOG_FILE):
+    """
+    filename: string
+    Reads building types from a CSV file with the columns id, key, name,
+        type (power or income), cost, income, power and image.
+    Returns a dict (of BuildingTypes) by building id.
+    """
+    types = {}
+
+    with open(filename) as f:
+        for row in csv.DictReader(f):
+            building_id = int(row['id'])
+
+            types[building_id] = BuildingType(building_id, row['key'],
+                    row['name'], TYPE_NAMES[row['type']], int(row['cost']),
+                    int(row['income']), int(row['power']), row['image'])
+
+    return types
+
+
+def load_unlocks(filename=UNLOCKS_FILE):
+    """
+    filename: string
+    Reads the unlock table from a CSV file with the columns income,
+        power, building (a building type key) and message.
+    Needs the building types to be loaded already.
+    Returns a list (of Unlocks) sorted by income.
+    """
+    unlocks = []
+
+    with open(filename) as f:
+        for row in csv.DictReader(f):
+            unlocks.append(Unlock(int(row['income']), int(row['power']),
+                    get_id(row['building']), row['message']))
+
+    # Tiers are unlocked in order, so the next one always has the lowest
+    # income threshold of those left
+    unlocks.sort(key=lambda unlock: unlock.income)
+
+    return unlocks
+
+
+def get_id(key):
+    """
+    key: string
+    Returns the building id of the building type with the given key.
+    Returns an int.
+    """
+    return KEYS[key].building_id
+
+
+def make_tables(types):
+    """
+    types: dict (of BuildingTypes)
+    Builds lookup tables indexed by building id: the income of each type,
+        and its power (positive for generators, negative for consumers).
+    Empty cells and unused ids have income and power 0.
+    Returns a tuple (list (of ints), list (of ints)).
+    """
+    incomes = [0] * (max(types) + 1)
+    powers = [0] * (max(types) + 1)
+
+    for building in types.values():
+        incomes[building.building_id] = building.income
+
+        if building.building_type == POWER:
+            powers[building.building_id] = building.power
+        else:
+            powers[building.building_id] = -building.power
+
+    return (incomes, powers)
+
+
+BUILDINGS = load_catalog()
+
+# The rules of a generic building that isn't in the catalog
+NO_BUILDING = BuildingType(None, None, None, 0, 0, 0, 0, None)
+
+KEYS = dict((building.key, building) for building in BUILDINGS.values())
+
+INCOMES, POWERS = make_tables(BUILDINGS)
+
+UNLOCKS = load_unlocks()
+
+# Building ids used by the rules
+SOLAR_PANEL = get_id('solar_panel')
+HOUSE = get_id('house')
+FACTORY = get_id('factory')
+SOLAR_FARM = get_id('solar_farm')
+CORPORATION = get_id('corporation')
+SUN = get_id('sun')
@@ -0,0 +1,378 @@
+"""
+Storage for the contents of a grid.
+Every field stores one value per cell, usually a building id (0 for an
+empty cell), and can count how many cells hold each of its values (ints
+from 0 up to the field's number of values), which is what a Simulation
+rebuilds its running totals from.
+ListField and SparseField can also hold any other object, such as
+sprites, with a different empty value.
+MappedField reads one byte per cell straight out of a buffer, such as
+a memory-mapped save file.
+"""
+
+import array
+import struct
+
+
+class ListField(object):
+    """
+    A field stored as a flat Python list, row by row.
+    If a typecode is given, the cells are kept in an array.array of that
+        type instead, which is smaller and much faster to copy.
+    Attributes:
+        width, height: int
+        values: int
+        empty: any object
+        cells: list or array.array
+
+    Methods:
+        get(x, y)
+        set(x, y, value)
+        occupied()
+        counts()
+        copy()
+        tobytes()
+    """
+    def __init__(self, width, height, values=256, empty=0, typecode=None):
+        self.width = width
+        self.height = height
+
+        # Number of different values (such as building ids) that can be
+        # counted, by default every value a byte can hold
+        self.values = values
+
+        self.empty = empty
+
+        if typecode is None:
+            self.cells = [empty] * (width * height)
+        else:
+            self.cells = array.array(typecode, [empty]) * (width * height)
+
+    def get(self, x, y):
+        """
+        x, y: int
+        Returns the value of the cell at (x, y).
+        Returns an int.
+        """
+        return self.cells[y * self.width + x]
+
+    def set(self, x, y, value):
+        """
+        x, y: int
+        value: int
+        Sets the value of the cell at (x, y).
+        """
+        self.cells[y * self.width + x] = value
+
+    def occupied(self):
+        """
+        Yields (x, y, value) for every non-empty cell.
+        """
+        width = self.width
+        empty = self.empty
+
+        for i, value in enumerate(self.cells):
+            if value != empty:
+                yield (i % width, i // width, value)
+
+    def counts(self):
+        """
+        Returns the number of cells holding each value.
+        Returns a list (of ints) indexed by value.
+        """
+        counts = [0] * self.values
+
+        for value in self.cells:
+            counts[value] += 1
+
+        return counts
+
+    def copy(self):
+        """
+        Returns a copy of the field that doesn't change with it.
+        Returns a ListField object.
+        """
+        field = ListField(0, 0, self.values, self.empty)
+
+        field.width = self.width
+        field.height = self.height
+        field.cells = self.cells[:]
+
+        return field
+
+    def tobytes(self):
+        """
+        Returns the cells as one byte each, row by row.
+        Only works for fields of ints from 0 to 255.
+        Returns a string of bytes.
+        """
+        if isinstance(self.cells, array.array) and self.cells.typecode == 'B':
+            return array_bytes(self.cells)
+
+        return array_bytes(array.array('B', self.cells))
+
+
+class SparseField(object):
+    """
+    A field stored as square chunks of cells, each a flat list.
+    A chunk is only allocated when a value is first put in it and is
+        dropped again once it is empty, so memory grows with the number
+        of occupied cells rather than the size of the grid.
+    If a typecode is given, each chunk is an array.array of that type
+        instead, which is smaller and much faster to copy.
+    Attributes:
+        width, height: int
+        values: int
+        empty: any object
+        chunk_size: int
+        typecode: string or None
+        chunks: dict (of lists or array.arrays)
+        filled: dict (of ints)
+
+    Methods:
+        get(x, y)
+        set(x, y, value)
+        occupied()
+        counts()
+        copy()
+        tobytes()
+    """
+    def __init__(self, width, height, values=256, empty=0, chunk_size=16,
+            typecode=None):
+        self.width = width
+        self.height = height
+
+        self.values = values
+
+        self.empty = empty
+        self.chunk_size = chunk_size
+        self.typecode = typecode
+
+        # Chunks by (column, row), and how many cells of each are occupied
+        self.chunks = {}
+        self.filled = {}
+
+    def get(self, x, y):
+        """
+        x, y: int
+        Returns the value of the cell at (x, y).
+        Returns an int.
+        """
+        size = self.chunk_size
+        chunk = self.chunks.get((x // size, y // size))
+
+        if chunk is None:
+            return self.empty
+
+        return chunk[(y % size) * size + x % size]
+
+    def set(self, x, y, value):
+        """
+        x, y: int
+        value: int
+        Sets the value of the cell at (x, y).
+        """
+        size = self.chunk_size
+        key = (x // size, y // size)
+        chunk = self.chunks.get(key)
+
+        if chunk is None:
+            if value == self.empty:
+                return
+
+            if self.typecode is None:
+                chunk = [self.empty] * (size * size)
+            else:
+                chunk = array.array(self.typecode, [self.empty]) * \
+                        (size * size)
+
+            self.chunks[key] = chunk
+            self.filled[key] = 0
+
+        i = (y % size) * size + x % size
+        was_empty = chunk[i] == self.empty
+        chunk[i] = value
+
+        if was_empty and value != self.empty:
+            self.filled[key] += 1
+
+        elif not was_empty and value == self.empty:
+            self.filled[key] -= 1
+
+            if self.filled[key] == 0:
+                del self.chunks[key]
+                del self.filled[key]
+
+    def occupied(self):
+        """
+        Yields (x, y, value) for every non-empty cell.
+        """
+        size = self.chunk_size
+        empty = self.empty
+
+        for (column, row), chunk in self.chunks.items():
+            for i, value in enumerate(chunk):
+                if value != empty:
+                    yield (column * size + i % size, row * size + i // size,
+                            value)
+
+    def counts(self):
+        """
+        Returns the number of cells holding each value.
+        Returns a list (of ints) indexed by value.
+        """
+        counts = [0] * self.values
+        n = 0
+
+        for x, y, value in self.occupied():
+            counts[value] += 1
+            n += 1
+
+        counts[self.empty] = self.width * self.height - n
+
+        return counts
+
+    def copy(self):
+        """
+        Returns a copy of the field that doesn't change with it.
+        Only the occupied chunks are copied, so this is much cheaper than
+            tobytes on a large map.
+        Returns a SparseField object.
+        """
+        field = SparseField(self.width, self.height, self.values,
+                self.empty, self.chunk_size, self.typecode)
+
+        field.chunks = dict((key, chunk[:])
+                for key, chunk in self.chunks.items())
+        field.filled = dict(self.filled)
+
+        return field
+
+    def tobytes(self):
+        """
+        Returns the cells as one byte each, row by row.
+        Only works for fields of ints from 0 to 255.
+        Returns a string of bytes.
+        """
+        size = self.chunk_size
+        cells = array.array('B', [0]) * (self.width * self.height)
+
+        # Copy each row of each chunk into place, leaving out any part of
+        # the chunk that hangs off the edge of the grid
+        for (column, row), chunk in self.chunks.items():
+            first_x = column * size
+            columns = min(size, self.width - first_x)
+
+            for y in range(min(size, self.height - row * size)):
+                start = (row * size + y) * self.width + first_x
+                part = chunk[y * size:y * size + columns]
+
+                if self.typecode != 'B':
+                    part = array.array('B', part)
+
+                cells[start:start + columns] = part
+
+        return array_bytes(cells)
+
+
+class MappedField(object):
+    """
+    A field of one byte per cell, row by row, read straight out of a
+        buffer (such as an mmap) starting at offset.
+    No Python object is made for a cell until it is asked for.
+    Attributes:
+        width, height: int
+        buffer: a writable buffer, such as an mmap
+        offset: int
+        values: int
+
+    Methods:
+        get(x, y)
+        set(x, y, value)
+        occupied()
+        counts()
+        copy()
+        tobytes()
+    """
+    def __init__(self, width, height, buffer, offset=0, values=256):
+        self.width = width
+        self.height = height
+
+        self.buffer = buffer
+        self.offset = offset
+
+        self.values = values
+
+    def get(self, x, y):
+        """
+        x, y: int
+        Returns the value of the cell at (x, y).
+        Returns an int.
+        """
+        return struct.unpack_from('B', self.buffer,
+                self.offset + y * self.width + x)[0]
+
+    def set(self, x, y, value):
+        """
+        x, y: int
+        value: int
+        Sets the value of the cell at (x, y).
+        """
+        struct.pack_into('B', self.buffer,
+                self.offset + y * self.width + x, value)
+
+    def occupied(self):
+        """
+        Yields (x, y, value) for every non-empty cell.
+        """
+        width = self.width
+
+        for y in range(self.height):
+            start = self.offset + y * width
+            row = bytearray(self.buffer[start:start + width])
+
+            for x, value in enumerate(row):
+                if value:
+                    yield (x, y, value)
+
+    def counts(self):
+        """
+        Returns the number of cells holding each value.
+        Returns a list (of ints) indexed by value.
+        """
+        cells = self.tobytes()
+
+        return [cells.count(struct.pack('B', value))
+                for value in range(self.values)]
+
+    def copy(self):
+        """
+        Returns a copy of the field that doesn't change with it, read out
+            of a buffer of its own.
+        Returns a MappedField object.
+        """
+        return MappedField(self.width, self.height,
+                bytearray(self.tobytes()), values=self.values)
+
+    def tobytes(self):
+        """
+        Returns the cells as one byte each, row by row.
+        Returns a string of bytes.
+        """
+        # A copied field's buffer is a bytearray, which zlib.crc32 won't
+        # take in Python 2
+        return bytes(self.buffer[self.offset:
+                self.offset + self.width * self.height])
+
+
+def array_bytes(cells):
+    """
+    cells: array.array
+    Returns the contents of an array as a string of bytes.
+    Returns a string of bytes.
+    """
+    # array.tostring was renamed tobytes in Python 3
+    if hasattr(cells, 'tobytes'):
+        return cells.tobytes()
+
+    return cells.tostring()
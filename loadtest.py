@@ -0,0 +1,312 @@
+"""
+A load test for the game server.
+Opens many sessions at once, each starting a game and then buying and
+placing buildings at a steady rate, and reports the latency of the
+requests, the delay of the income ticks pushed by the server and how
+many sessions the server could host per core of CPU it used.
+Needs Python 3, like the server.
+
+    python3 loadtest.py [--sessions 500] [--duration 20]
+                        [--actions 1.0] [--interval 1000] [--spawn]
+                        [--host 127.0.0.1] [--port 8765]
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import subprocess
+import sys
+import time
+import server
+import simulation
+
+
+SERVER = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+        'server.py')
+
+# Message layouts by the kind byte they start with
+MESSAGES = {
+    server.REPLY_KIND: server.REPLY,
+    server.TICK_KIND: server.TICK,
+    server.STATS_KIND: server.STATS,
+    }
+
+
+class Client(object):
+    """
+    One session's connection to the server.
+    Replies are matched to requests in order; ticks are counted as they
+        arrive.
+    Attributes:
+        reader: asyncio.StreamReader
+        writer: asyncio.StreamWriter
+        replies: asyncio.Queue
+        reading: asyncio.Future or None
+        latencies: list (of floats)
+        tick_delays: list (of ints)
+
+    Methods:
+        connect(host, port)
+        read()
+        request(op, building_id=0, x=0, y=0)
+        close()
+    """
+    def __init__(self, latencies, tick_delays):
+        self.reader = None
+        self.writer = None
+        self.replies = asyncio.Queue()
+        self.reading = None
+
+        # Shared between every client
+        self.latencies = latencies
+        self.tick_delays = tick_delays
+
+    async def connect(self, host, port):
+        """
+        host: string
+        port: int
+        Connects to the server and starts reading its messages.
+        """
+        self.reader, self.writer = await asyncio.open_connection(host, port)
+        self.reading = asyncio.ensure_future(self.read())
+
+    async def read(self):
+        """
+        Reads messages until the connection closes, queueing replies and
+            recording the delay of each tick.
+        """
+        try:
+            while True:
+                kind = (await self.reader.readexactly(1))[0]
+                message = MESSAGES[kind]
+                data = await self.reader.readexactly(message.size - 1)
+                fields = message.unpack(bytes([kind]) + data)
+
+                if kind == server.TICK_KIND:
+                    self.tick_delays.append(fields[2])
+                else:
+                    self.replies.put_nowait(fields)
+
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+
+    async def request(self, op, building_id=0, x=0, y=0):
+        """
+        op: int
+        building_id: int
+        x, y: int
+        Sends a request and waits for its reply, recording how long it
+            took.
+        Returns the reply's fields.
+        Returns a tuple.
+        """
+        start = time.perf_counter()
+
+        self.writer.write(server.REQUEST.pack(op, building_id, x, y))
+        reply = await self.replies.get()
+
+        self.latencies.append(time.perf_counter() - start)
+
+        return reply
+
+    async def close(self):
+        """
+        Closes the connection.
+        """
+        self.writer.close()
+        await self.reading
+
+
+async def play(client, deadline, actions, width, height, rng):
+    """
+    client: Client
+    deadline: float
+    actions: float
+    width, height: int
+    rng: random.Random
+    Starts a game, then about actions times a second buys a house (or a
+        solar panel, if there isn't the power for a house) and places it
+        on the next free cell, until the deadline.
+    """
+    await client.request(server.START)
+
+    # The server's games start with a solar panel at Simulation's
+    # default start location
+    start_loc = simulation.get_start_loc(width, height)
+    cells = [(x, y) for y in range(height) for x in range(width)
+            if (x, y) != start_loc]
+
+    while time.perf_counter() < deadline:
+        await asyncio.sleep(rng.expovariate(actions))
+
+        if not cells:
+            await client.request(server.STATUS)
+            continue
+
+        for building_id in (simulation.HOUSE, simulation.SOLAR_PANEL):
+            if (await client.request(server.PICK, building_id))[2]:
+                await client.request(server.PLACE, 0, *cells.pop())
+                break
+
+
+def percentiles(values, points=(50, 99)):
+    """
+    values: list (of numbers)
+    points: tuple (of numbers)
+    Returns the given percentiles of the values (nearest rank), or
+        zeros if there are none.
+    Returns a list (of numbers).
+    """
+    if not values:
+        return [0 for point in points]
+
+    values = sorted(values)
+
+    return [values[min(len(values) - 1, len(values) * point // 100)]
+            for point in points]
+
+
+async def stats(host, port):
+    """
+    host: string
+    port: int
+    Asks the server for its stats over a connection of its own.
+    Returns a tuple of the stats message's fields.
+    """
+    client = Client([], [])
+    await client.connect(host, port)
+
+    fields = await client.request(server.STATS_OP)
+
+    await client.close()
+
+    return fields
+
+
+async def run(host, port, sessions, duration, actions, width, height):
+    """
+    host: string
+    port: int
+    sessions: int
+    duration: float
+    actions: float
+    width, height: int
+    Runs the given number of sessions for duration seconds and prints
+        the results.
+    """
+    latencies = []
+    tick_delays = []
+
+    clients = [Client(latencies, tick_delays) for i in range(sessions)]
+
+    for client in clients:
+        await client.connect(host, port)
+
+    before = await stats(host, port)
+    start = time.perf_counter()
+
+    deadline = start + duration
+    rng = random.Random(0)
+
+    await asyncio.gather(*[play(client, deadline, actions, width, height,
+            random.Random(rng.random())) for client in clients])
+
+    wall = time.perf_counter() - start
+    after = await stats(host, port)
+
+    for client in clients:
+        await client.close()
+
+    ticks = after[2] - before[2]
+    cpu = (after[3] - before[3]) / 1000000.0
+    work = (after[4] - before[4]) / 1000000.0
+
+    latency_p50, latency_p99 = percentiles(latencies)
+    delay_p50, delay_p99 = percentiles(tick_delays)
+
+    print("%d sessions for %.1f s: %d requests, %d ticks received" %
+            (sessions, wall, len(latencies), len(tick_delays)))
+    print("request latency: p50 %.2f ms, p99 %.2f ms" %
+            (latency_p50 * 1000, latency_p99 * 1000))
+    print("tick delay: p50 %.2f ms, p99 %.2f ms, max %.2f ms" %
+            (delay_p50 / 1000.0, delay_p99 / 1000.0, after[5] / 1000.0))
+
+    if ticks:
+        print("tick work: %.2f ms per tick for every session" %
+                (work / ticks * 1000))
+
+    if cpu > 0:
+        print("server CPU: %.2f cores, %.0f sessions per core" %
+                (cpu / wall, sessions / (cpu / wall)))
+
+
+async def wait_for_server(host, port, timeout=10.0):
+    """
+    host: string
+    port: int
+    timeout: float
+    Waits until the server accepts connections.
+    """
+    deadline = time.perf_counter() + timeout
+
+    while True:
+        try:
+            reader, writer = await asyncio.open_connection(host, port)
+            writer.close()
+            return
+
+        except OSError:
+            if time.perf_counter() > deadline:
+                raise
+
+            await asyncio.sleep(0.1)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test the game "
+            "server.")
+    parser.add_argument('--host', default='127.0.0.1',
+            help="server address (default: %(default)s)")
+    parser.add_argument('--port', type=int, default=8765,
+            help="server port (default: %(default)s)")
+    parser.add_argument('--sessions', type=int, default=500,
+            help="sessions to open (default: %(default)s)")
+    parser.add_argument('--duration', type=float, default=20.0,
+            help="seconds to run for (default: %(default)s)")
+    parser.add_argument('--actions', type=float, default=1.0,
+            help="purchases per second per session (default: %(default)s)")
+    parser.add_argument('--width', type=int, default=10,
+            help="server grid width (default: %(default)s)")
+    parser.add_argument('--height', type=int, default=10,
+            help="server grid height (default: %(default)s)")
+    parser.add_argument('--spawn', action='store_true',
+            help="start a server for the test")
+    parser.add_argument('--interval', type=int, default=1000,
+            help="income tick length of a spawned server, in milliseconds "
+            "(default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    process = None
+
+    if args.spawn:
+        process = subprocess.Popen([sys.executable, SERVER,
+                '--host', args.host, '--port', str(args.port),
+                '--interval', str(args.interval),
+                '--width', str(args.width), '--height', str(args.height)])
+
+    try:
+        asyncio.run(wait_for_server(args.host, args.port))
+        asyncio.run(run(args.host, args.port, args.sessions, args.duration,
+                args.actions, args.width, args.height))
+
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,339 @@
+"""
+A build-order optimizer for "A solar system".
+Searches for the order to buy buildings in that unlocks the Sun (or
+earns $1,000,000) in the fewest income ticks, using the building
+catalog and the unlock table. Each candidate order is played out by a
+headless Simulation on a pool of worker processes. The best orders of
+each generation are kept and mutated into the next. Any candidate that
+can't beat the best so far is cut off as soon as it falls behind.
+
+    python optimize.py [--goal sun|rich] [--generations 20]
+                       [--population 400] [--keep 40] [--processes N]
+                       [--seed 0] [--max-ticks 100000]
+"""
+
+import argparse
+import multiprocessing
+import random
+import sys
+import timeit
+import catalog
+import simulation
+
+
+GOALS = ['sun', 'rich']
+
+# Buildings an order can be made of, in unlock order
+CHOICES = [simulation.HOUSE] + [unlock.building_id
+        for unlock in simulation.UNLOCKS]
+
+# The best ticks found so far, shared with the worker processes by
+# init_worker so they can give up on an order as soon as it falls behind
+BEST_TICKS = None
+
+
+def reached(sim, goal):
+    """
+    sim: simulation.Simulation
+    goal: string
+    Returns True if the simulation has reached the goal.
+    Returns a bool.
+    """
+    if goal == 'sun':
+        return simulation.SUN in sim.palette
+
+    return sim.income >= simulation.RICH
+
+
+def evaluate(order, goal='sun', max_ticks=100000, width=10, height=10,
+        best=None):
+    """
+    order: list (of ints)
+    goal: string
+    max_ticks: int
+    width, height: int
+    best: multiprocessing.Value (of an int) or None
+    Plays out a build order: every tick, buys and places as many of the
+        buildings next in the order as can be paid for, in order.
+        An income building there isn't enough power for is skipped,
+        since waiting never brings more power.
+    Between purchases the simulation is fast forwarded straight to the
+        tick when the next building, unlock or the goal is in reach.
+    If best is given, the order is also given up on once it is behind
+        best's value, which is read again after every purchase so it
+        can be lowered while the order is being played out.
+    Returns the ticks it took to reach the goal (or None if it wasn't
+        reached within max_ticks) and how many buildings of the order
+        were used by then.
+    Returns a tuple (int or None, int).
+    """
+    sim = simulation.Simulation(width, height)
+    sim.start()
+
+    cells = ((x, y) for y in range(height) for x in range(width)
+            if (x, y) != sim.start_loc)
+
+    i = 0
+
+    while True:
+        while i < len(order) and not sim.is_full():
+            building_id = order[i]
+
+            if building_id not in sim.palette:
+                break
+
+            if sim.pick(building_id):
+                sim.place(next(cells))
+                i += 1
+
+            elif catalog.BUILDINGS[building_id].building_type == \
+                    simulation.POWER:
+                break
+
+            else:
+                i += 1
+
+        if reached(sim, goal):
+            return (sim.ticks, i)
+
+        rate = sim.income_per_tick
+        limit = max_ticks if best is None else min(max_ticks, best.value)
+
+        if sim.ticks >= limit or sim.placed <= 1 or rate <= 0:
+            return (None, i)
+
+        # Income needed for the next thing that can change the game
+        targets = [sim.next_threshold]
+
+        if goal == 'rich':
+            targets.append(simulation.RICH)
+
+        if i < len(order) and order[i] in sim.palette:
+            targets.append(catalog.BUILDINGS[order[i]].cost)
+
+        target = min(targets)
+
+        if target == simulation.NEVER:
+            return (None, i)
+
+        wait = max(1, -(-(int(target) - sim.income) // rate))
+        sim.fast_forward(min(wait, limit - sim.ticks))
+
+
+def init_worker(best):
+    """
+    best: multiprocessing.Value (of an int)
+    Keeps the shared best ticks for evaluate_task on a worker process.
+    """
+    global BEST_TICKS
+    BEST_TICKS = best
+
+
+def evaluate_task(task):
+    """
+    task: tuple (list (of ints), string, int, int, int)
+    Evaluates an (order, goal, max_ticks, width, height) task on a
+        worker process, cut off at the best ticks found so far.
+    Returns a tuple (int or None, list (of ints)) of the ticks and the
+        part of the order that was used.
+    """
+    ticks, used = evaluate(*task, best=BEST_TICKS)
+    return (ticks, task[0][:used])
+
+
+def random_order(rng, length):
+    """
+    rng: random.Random
+    length: int
+    Returns a random build order of the given length.
+    Returns a list (of ints).
+    """
+    return [rng.choice(CHOICES) for i in range(length)]
+
+
+def mutate(rng, order, length):
+    """
+    rng: random.Random
+    order: list (of ints)
+    length: int
+    Returns a copy of a build order with one random change: a building
+        replaced, inserted, removed or swapped with another.
+    Orders are kept no longer than length.
+    Returns a list (of ints).
+    """
+    order = list(order)
+    change = rng.randrange(4)
+    i = rng.randrange(len(order) + 1)
+
+    if change == 0 and i < len(order):
+        order[i] = rng.choice(CHOICES)
+    elif change == 1 and len(order) < length:
+        order.insert(i, rng.choice(CHOICES))
+    elif change == 2 and i < len(order):
+        del order[i]
+    elif len(order) > 1:
+        j = rng.randrange(len(order))
+        i = min(i, len(order) - 1)
+        order[i], order[j] = order[j], order[i]
+
+    return order
+
+
+def describe(order):
+    """
+    order: list (of ints)
+    Returns a build order as building names with repeat counts, such as
+        "house x3, solar panel x1".
+    Returns a string.
+    """
+    runs = []
+
+    for building_id in order:
+        if runs and runs[-1][0] == building_id:
+            runs[-1][1] += 1
+        else:
+            runs.append([building_id, 1])
+
+    return ", ".join("%s x%d" % (catalog.BUILDINGS[building_id].name.lower(),
+            n) for building_id, n in runs)
+
+
+def search(pool, processes, best, goal, generations, population, keep,
+        seed, max_ticks, width, height):
+    """
+    pool: multiprocessing.Pool
+    processes: int
+    best: multiprocessing.Value (of an int)
+    goal: string
+    generations, population, keep: int
+    seed: int
+    max_ticks: int
+    width, height: int
+    Evolves build orders for the given number of generations, printing
+        the best order as it improves and the throughput of each
+        generation.
+    Results are streamed back from the pool as they finish, and best
+        is lowered as soon as one beats it, so the workers (set up with
+        init_worker(best)) cut off the orders still running at the new
+        best right away.
+    Returns a tuple (int or None, list (of ints)) of the best ticks and
+        order.
+    """
+    rng = random.Random(seed)
+    length = width * height - 1
+
+    # Orders only need to be long enough to reach the goal, and trimmed
+    # to the part that was used once they have
+    start_length = min(length, 30)
+
+    candidates = [random_order(rng, rng.randrange(1, start_length + 1))
+            for i in range(population)]
+
+    best_ticks, best_order = None, []
+    survivors = []
+    total = 0
+    start = timeit.default_timer()
+
+    for generation in range(generations):
+        tasks = [(order, goal, max_ticks, width, height)
+                for order in candidates]
+
+        generation_start = timeit.default_timer()
+        results = []
+
+        for ticks, order in pool.imap_unordered(evaluate_task, tasks,
+                max(1, len(tasks) // (processes * 4))):
+            if ticks is None:
+                continue
+
+            results.append((ticks, len(order), order))
+
+            if best_ticks is None or (ticks, len(order)) < \
+                    (best_ticks, len(best_order)):
+                best_ticks, best_order = ticks, order
+                best.value = ticks
+                print("  %d ticks: %s" % (ticks, describe(order)))
+
+        elapsed = timeit.default_timer() - generation_start
+        total += len(tasks)
+
+        print("generation %d: %d of %d finished, best %s ticks, "
+                "%.0f simulations/s/core" % (generation, len(results),
+                len(tasks), best_ticks,
+                len(tasks) / elapsed / processes))
+
+        # Keep the best orders (old and new), then fill the next
+        # generation with mutations of them and a few new random orders
+        results.sort(key=lambda result: result[:2])
+        survivors = sorted(survivors + results[:keep],
+                key=lambda result: result[:2])[:keep]
+
+        candidates = []
+
+        while len(candidates) < population:
+            if survivors and rng.random() < 0.9:
+                parent = rng.choice(survivors)[2]
+                candidates.append(mutate(rng, parent, length))
+            else:
+                candidates.append(random_order(rng,
+                        rng.randrange(1, start_length + 1)))
+
+    elapsed = timeit.default_timer() - start
+
+    print("%d simulations in %.2f s on %d processes: "
+            "%.0f simulations/s/core" % (total, elapsed, processes,
+            total / elapsed / processes))
+
+    return (best_ticks, best_order)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Search for the fastest "
+            "build order.")
+    parser.add_argument('--goal', choices=GOALS, default='sun',
+            help="unlock the Sun or earn $1,000,000 (default: %(default)s)")
+    parser.add_argument('--generations', type=int, default=20,
+            help="rounds of search (default: %(default)s)")
+    parser.add_argument('--population', type=int, default=400,
+            help="orders tried per round (default: %(default)s)")
+    parser.add_argument('--keep', type=int, default=40,
+            help="best orders kept between rounds (default: %(default)s)")
+    parser.add_argument('--processes', type=int,
+            default=multiprocessing.cpu_count(),
+            help="worker processes (default: %(default)s)")
+    parser.add_argument('--seed', type=int, default=0,
+            help="random seed (default: %(default)s)")
+    parser.add_argument('--max-ticks', type=int, default=100000,
+            help="ticks before an order is given up on "
+            "(default: %(default)s)")
+    parser.add_argument('--width', type=int, default=10,
+            help="grid width (default: %(default)s)")
+    parser.add_argument('--height', type=int, default=10,
+            help="grid height (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    # Lowered by search as better orders are found, and read by the
+    # workers while they play out orders
+    best = multiprocessing.Value('i', args.max_ticks)
+    pool = multiprocessing.Pool(args.processes, init_worker, (best,))
+
+    try:
+        ticks, order = search(pool, args.processes, best, args.goal,
+                args.generations, args.population, args.keep, args.seed,
+                args.max_ticks, args.width, args.height)
+    finally:
+        pool.close()
+        pool.join()
+
+    if ticks is None:
+        print("No order reached the goal within %d ticks" % args.max_ticks)
+        return 1
+
+    print("Best: %d ticks (%d buildings)" % (ticks, len(order)))
+    print(describe(order))
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
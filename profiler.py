@@ -0,0 +1,246 @@
+"""
+Frame timing for "A solar system".
+A FrameProfiler records how long each phase of a frame took, with the
+number of blits and pixels pushed to the screen, in a fixed-size ring
+buffer. It can draw percentiles of the frame times as an overlay and
+export the buffer as CSV.
+While disabled the game's methods are left untouched, so the only cost
+is a couple of method calls per frame that return straight away.
+"""
+
+import array
+import csv
+import functools
+import timeit
+import pygame
+import ui
+
+
+# Phases timed while the profiler is enabled: the Game method (or the
+# compositor's flush) timed for each, by phase name
+PHASES = [
+    ('events', 'handle_event'),
+    ('update_income', 'update_income'),
+    ('add_unlock', 'add_unlock'),
+    ('draw_mouse', 'draw_mouse'),
+    ('draw_text', 'draw_text'),
+    ('display_update', 'flush'),
+    ]
+
+
+class FrameProfiler(object):
+    """
+    Records per-phase timings of the last size frames.
+    Phase times include any other phase called from inside them (for
+        example, draw_text inside update_income).
+    Attributes:
+        size: int
+        enabled: bool
+        overlay: bool
+        overlay_rect: pygame.Rect
+        frames: int
+        times: dict (of array.arrays)
+        totals, blits, pixels: array.array
+        current: dict (of floats)
+        frame_start: float or None
+
+    Methods:
+        enable(game)
+        disable(game)
+        begin_frame()
+        add(phase, seconds)
+        end_frame(blits, pixels)
+        percentiles(values=(50, 95, 99))
+        draw_overlay(surface)
+        write_csv(filename)
+    """
+    def __init__(self, size=600):
+        self.size = size
+
+        self.enabled = False
+        self.overlay = False
+        self.overlay_rect = pygame.Rect(440, 5, 155, 60)
+
+        # Frames recorded so far; frame n is kept at index n % size
+        self.frames = 0
+
+        self.times = dict((phase, array.array('d', [0.0]) * size)
+                for phase, method in PHASES)
+        self.totals = array.array('d', [0.0]) * size
+        self.blits = array.array('l', [0]) * size
+        self.pixels = array.array('l', [0]) * size
+
+        # Phase times and start time of the frame being timed; there is
+        # no start time until begin_frame is called while enabled
+        self.current = dict((phase, 0.0) for phase, method in PHASES)
+        self.frame_start = None
+
+        self.font = None
+
+    def enable(self, game):
+        """
+        game: solar.Game
+        Starts timing the game's phases by wrapping the methods for each
+            phase on the game (and its compositor).
+        Timing starts with the next frame; the frame the profiler is
+            enabled in isn't recorded, since it was never begun.
+        """
+        if self.enabled:
+            return
+
+        self.enabled = True
+        self.frame_start = None
+
+        for phase, method in PHASES:
+            target = game.compositor if method == 'flush' else game
+            setattr(target, method, self.timed(phase, getattr(target, method)))
+
+    def disable(self, game):
+        """
+        game: solar.Game
+        Stops timing the game's phases, putting its methods back.
+        """
+        if not self.enabled:
+            return
+
+        self.enabled = False
+
+        for phase, method in PHASES:
+            target = game.compositor if method == 'flush' else game
+            delattr(target, method)
+
+    def timed(self, phase, function):
+        """
+        phase: string
+        function: function
+        Returns a function that calls the given function and adds the
+            time it took to the given phase.
+        Returns a function.
+        """
+        add = self.add
+        timer = timeit.default_timer
+
+        @functools.wraps(function)
+        def timed_function(*args, **kwargs):
+            start = timer()
+
+            try:
+                return function(*args, **kwargs)
+            finally:
+                add(phase, timer() - start)
+
+        return timed_function
+
+    def begin_frame(self):
+        """
+        Starts timing a frame.
+        """
+        if not self.enabled:
+            return
+
+        for phase in self.current:
+            self.current[phase] = 0.0
+
+        self.frame_start = timeit.default_timer()
+
+    def add(self, phase, seconds):
+        """
+        phase: string
+        seconds: float
+        Adds time spent in a phase to the current frame.
+        """
+        self.current[phase] += seconds
+
+    def end_frame(self, blits, pixels):
+        """
+        blits: int
+        pixels: int
+        Finishes timing a frame and stores it in the ring buffer, with
+            the number of blits and pixels pushed to the screen.
+        Does nothing for a frame that begin_frame wasn't called for.
+        """
+        if not self.enabled or self.frame_start is None:
+            return
+
+        i = self.frames % self.size
+
+        for phase, seconds in self.current.items():
+            self.times[phase][i] = seconds
+
+        self.totals[i] = timeit.default_timer() - self.frame_start
+        self.blits[i] = blits
+        self.pixels[i] = pixels
+
+        self.frames += 1
+        self.frame_start = None
+
+    def percentiles(self, values=(50, 95, 99)):
+        """
+        values: tuple or list (of numbers)
+        Returns the given percentiles of the recorded frame times, in
+            seconds (nearest rank), or zeros if nothing is recorded.
+        Returns a list (of floats).
+        """
+        count = min(self.frames, self.size)
+
+        if count == 0:
+            return [0.0 for value in values]
+
+        totals = sorted(self.totals[:count])
+
+        return [totals[min(count - 1, int(count * value / 100.0))]
+                for value in values]
+
+    def draw_overlay(self, surface):
+        """
+        surface: pygame.Surface
+        Draws the p50/p95/p99 frame times and the last frame's blits and
+            pixels over the top right of the surface.
+        Returns the pygame.Rect that was drawn.
+        """
+        if self.font is None:
+            self.font = ui.get_font(None, 18)
+
+        p50, p95, p99 = self.percentiles()
+        last = (self.frames - 1) % self.size
+
+        lines = [
+            "p50 %.2f ms  p95 %.2f ms" % (p50 * 1000, p95 * 1000),
+            "p99 %.2f ms  frames %d" % (p99 * 1000, self.frames),
+            "blits %d  pixels %d" % (self.blits[last], self.pixels[last]),
+            ]
+
+        surface.fill((0, 0, 0), self.overlay_rect)
+
+        y = self.overlay_rect.top + 2
+
+        for line in lines:
+            text = self.font.render(line, True, (255, 255, 0))
+            surface.blit(text, (self.overlay_rect.left + 4, y))
+            y += text.get_height() + 2
+
+        return self.overlay_rect
+
+    def write_csv(self, filename):
+        """
+        filename: string
+        Writes the recorded frames, oldest first, to a CSV file with one
+            column per phase (in milliseconds) plus the frame total, blits
+            and pixels.
+        """
+        count = min(self.frames, self.size)
+        first = self.frames - count
+        phases = [phase for phase, method in PHASES]
+
+        with open(filename, 'w') as f:
+            writer = csv.writer(f)
+            writer.writerow(['frame'] + phases + ['total', 'blits', 'pixels'])
+
+            for frame in range(first, self.frames):
+                i = frame % self.size
+
+                writer.writerow([frame] +
+                        ["%.4f" % (self.times[phase][i] * 1000)
+                            for phase in phases] +
+                        ["%.4f" % (self.totals[i] * 1000), self.blits[i],
+                            self.pixels[i]])
@@ -0,0 +1,162 @@
+"""
+Recording the input of a game of "A solar system" so it can be replayed.
+A recording is a fixed header, one fixed-size record per input event
+and, once the game has ended, the final state of the game:
+
+    header   magic, version, grid width, grid height
+    events   income tick number, kind, x, y
+    end      an event of kind END
+    final    income ticks, income, power, placed buildings, CRC-32 of
+             the cells, palette length
+    palette  one byte per unlocked building id
+
+Each event is stamped with the number of income ticks that came before
+it, so replaying the events in order between the same ticks gives the
+same game, however long the ticks took to arrive.
+"""
+
+import struct
+import zlib
+
+
+MAGIC = b'SREC'
+VERSION = 1
+
+HEADER = struct.Struct('<4sHII')
+EVENT = struct.Struct('<IBii')
+FINAL = struct.Struct('<IqqIIB')
+
+# Kinds of event
+END = 0
+CLICK = 1
+PAN = 2
+PAINT = 3
+RELEASE = 4
+FILL = 5
+
+
+class RecordingError(ValueError):
+    """A recording that is truncated, corrupt or from another version."""
+
+
+class Recorder(object):
+    """
+    Writes the input events of a game to a recording as they happen.
+    Attributes:
+        filename: string
+        ticks: int
+        events: int
+        file: file
+
+    Methods:
+        tick()
+        record(kind, x, y)
+        close(sim)
+    """
+    def __init__(self, filename, width, height):
+        self.filename = filename
+
+        # Income ticks and events recorded so far
+        self.ticks = 0
+        self.events = 0
+
+        self.file = open(filename, 'wb')
+        self.file.write(HEADER.pack(MAGIC, VERSION, width, height))
+
+    def tick(self):
+        """
+        Counts an income tick.
+        """
+        self.ticks += 1
+
+    def record(self, kind, x, y):
+        """
+        kind: int
+        x, y: int
+        Writes an event, stamped with the current income tick.
+        """
+        self.file.write(EVENT.pack(self.ticks, kind, x, y))
+        self.events += 1
+
+    def close(self, sim):
+        """
+        sim: simulation.Simulation
+        Ends the recording with the final state of the simulation.
+        """
+        self.file.write(EVENT.pack(self.ticks, END, 0, 0))
+        self.file.write(FINAL.pack(*final_state(sim, self.ticks)[:-1]))
+        self.file.write(struct.pack('%dB' % len(sim.palette), *sim.palette))
+
+        self.file.close()
+
+
+def final_state(sim, ticks):
+    """
+    sim: simulation.Simulation
+    ticks: int
+    Returns the state of a simulation that a replay is checked against:
+        the income ticks, income, power, placed buildings, CRC-32 of the
+        cells, palette length and palette.
+    Returns a tuple.
+    """
+    cells_crc = zlib.crc32(sim.field.tobytes()) & 0xffffffff
+
+    return (ticks, sim.income, sim.power, sim.placed, cells_crc,
+            len(sim.palette), tuple(sim.palette))
+
+
+def read(filename):
+    """
+    filename: string
+    Reads a recording.
+    The final state is None if the game never ended (for example, if it
+        crashed), in which case a replay can't be checked.
+    Raises RecordingError if the file isn't a valid recording.
+    Returns a tuple (int, int, list (of tuples), tuple or None) of the
+        grid width and height, the events as (tick, kind, x, y) and the
+        final state, laid out as final_state returns it.
+    """
+    with open(filename, 'rb') as f:
+        data = f.read()
+
+    if len(data) < HEADER.size:
+        raise RecordingError("%s is too short to be a recording" % filename)
+
+    magic, version, width, height = HEADER.unpack_from(data, 0)
+
+    if magic != MAGIC:
+        raise RecordingError("%s is not a recording" % filename)
+
+    if version != VERSION:
+        raise RecordingError("%s is recording version %d, not %d" %
+                (filename, version, VERSION))
+
+    events = []
+    offset = HEADER.size
+
+    while offset + EVENT.size <= len(data):
+        event = EVENT.unpack_from(data, offset)
+        offset += EVENT.size
+
+        if event[1] == END:
+            break
+
+        events.append(event)
+
+    else:
+        return (width, height, events, None)
+
+    if offset + FINAL.size > len(data):
+        raise RecordingError("%s is truncated" % filename)
+
+    final = FINAL.unpack_from(data, offset)
+    offset += FINAL.size
+
+    palette_length = final[-1]
+
+    if offset + palette_length != len(data):
+        raise RecordingError("%s is the wrong size" % filename)
+
+    palette = struct.unpack_from('%dB' % palette_length, data, offset)
+
+    return (width, height, events, final + (palette,))
@@ -0,0 +1,357 @@
+"""
+Saving and loading games of "A solar system".
+A save file is a fixed header, the palette, one byte per grid cell
+(the building id) and a CRC-32 of everything before it:
+
+    header   magic, version, width, height, start_loc, income, power,
+             ticks, saved_at, started, held, palette length
+    palette  one byte per unlocked building id
+    cells    width * height bytes, row by row
+    crc      CRC-32 of the header, palette and cells
+
+Loading memory-maps the file, so the cells are read straight out of it
+as they are needed instead of being built up one Python object at a time.
+An Autosaver takes snapshots on the calling thread and writes them on a
+worker thread, so saving doesn't hold up the game.
+"""
+
+import mmap
+import os
+import struct
+import threading
+import time
+import timeit
+import zlib
+
+import catalog
+import fields
+import simulation
+
+
+MAGIC = b'SOLR'
+VERSION = 1
+
+HEADER = struct.Struct('<4sHIIIIqqQd?bB')
+CRC = struct.Struct('<I')
+
+# Bytes of the file checksummed at a time while loading
+CRC_BLOCK = 1 << 20
+
+
+class SaveFileError(ValueError):
+    """A save file that is truncated, corrupt or from another version."""
+
+
+class Snapshot(object):
+    """
+    A copy of the state of a Simulation, ready to be written to a file.
+    Attributes:
+        width, height: int
+        start_loc: tuple (of ints)
+        income, power: int
+        ticks: int
+        saved_at: float
+        started: bool
+        held: int or None
+        palette: list (of ints)
+        field: a copy of the simulation's field
+    """
+    def __init__(self, sim):
+        self.width = sim.width
+        self.height = sim.height
+        self.start_loc = tuple(sim.start_loc)
+
+        self.income = sim.income
+        self.power = sim.power
+        self.ticks = sim.ticks
+        self.saved_at = time.time()
+
+        self.started = sim.started
+        self.held = sim.held
+        self.palette = list(sim.palette)
+
+        # The only part that grows with the map. Copying the field is
+        # cheap for every kind of field (a sparse one only copies its
+        # occupied chunks); turning it into one byte per cell is left to
+        # encode, on the autosaver's worker thread
+        self.field = sim.field.copy()
+
+
+def encode(snapshot):
+    """
+    snapshot: Snapshot
+    Packs a snapshot into the save file format, including one byte for
+        every cell of its field.
+    Returns a string of bytes.
+    """
+    held = -1 if snapshot.held is None else snapshot.held
+
+    header = HEADER.pack(MAGIC, VERSION, snapshot.width, snapshot.height,
+            snapshot.start_loc[0], snapshot.start_loc[1], snapshot.income,
+            snapshot.power, snapshot.ticks, snapshot.saved_at,
+            snapshot.started, held, len(snapshot.palette))
+    palette = struct.pack('%dB' % len(snapshot.palette), *snapshot.palette)
+
+    data = header + palette + snapshot.field.tobytes()
+    crc = zlib.crc32(data) & 0xffffffff
+
+    return data + CRC.pack(crc)
+
+
+def write(snapshot, filename):
+    """
+    snapshot: Snapshot
+    filename: string
+    Writes a snapshot to a file.
+    The file is written under a temporary name, synced to disk and then
+        renamed, so an existing save is never left half written.
+    """
+    temp = filename + '.tmp'
+
+    with open(temp, 'wb') as f:
+        f.write(encode(snapshot))
+        f.flush()
+        os.fsync(f.fileno())
+
+    # os.rename can't replace an existing file on Windows
+    if os.name == 'nt' and os.path.exists(filename):
+        os.remove(filename)
+
+    os.rename(temp, filename)
+
+
+def save(sim, filename):
+    """
+    sim: simulation.Simulation
+    filename: string
+    Saves the state of a simulation to a file.
+    """
+    write(Snapshot(sim), filename)
+
+
+def load(filename):
+    """
+    filename: string
+    Loads a simulation from a save file.
+    The simulation's field reads from a private memory map of the file,
+        so changes to it are never written back.
+    Raises SaveFileError if the file isn't a valid save file.
+    Returns a tuple (simulation.Simulation, float) of the simulation and
+        the time it was saved at.
+    """
+    with open(filename, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+
+        if size < HEADER.size + CRC.size:
+            raise SaveFileError("%s is too short to be a save file" % filename)
+
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+
+    (magic, version, width, height, start_x, start_y, income, power, ticks,
+            saved_at, started, held, palette_length) = HEADER.unpack_from(
+                    buffer, 0)
+
+    if magic != MAGIC:
+        raise SaveFileError("%s is not a save file" % filename)
+
+    if version != VERSION:
+        raise SaveFileError("%s is save file version %d, not %d" %
+                (filename, version, VERSION))
+
+    offset = HEADER.size + palette_length
+
+    if size != offset + width * height + CRC.size:
+        raise SaveFileError("%s is the wrong size for its grid" % filename)
+
+    # Checksum a block at a time to avoid copying the whole map at once
+    crc = 0
+    end = size - CRC.size
+
+    for start in range(0, end, CRC_BLOCK):
+        crc = zlib.crc32(buffer[start:min(start + CRC_BLOCK, end)], crc)
+
+    if crc & 0xffffffff != CRC.unpack_from(buffer, end)[0]:
+        raise SaveFileError("%s is corrupt" % filename)
+
+    # A sparse field is the cheapest to make before it is replaced
+    sim = simulation.Simulation(width, height, start_loc=(start_x, start_y),
+            sparse=True)
+    sim.field = fields.MappedField(width, height, buffer, offset,
+            len(catalog.INCOMES))
+    sim.recount()
+
+    sim.income = income
+    sim.power = power
+    sim.ticks = ticks
+
+    sim.started = started
+    sim.held = None if held < 0 else held
+    sim.palette = list(struct.unpack_from('%dB' % palette_length, buffer,
+            HEADER.size))
+    sim.update_next_unlock()
+
+    return (sim, saved_at)
+
+
+class Autosaver(object):
+    """
+    Writes snapshots of a simulation to a file on a worker thread.
+    Taking a snapshot only copies the simulation's totals and field;
+        laying the cells out, packing, checksumming, writing and syncing
+        happen on the worker.
+    At most one snapshot waits to be written. While one is waiting or
+        being written, new requests are skipped rather than queued.
+    A write that fails is kept as error until take_error is called.
+    Attributes:
+        filename: string
+        pending: Snapshot or None
+        busy, closed: bool
+        error: Exception or None
+        snapshots, skipped, writes, failures: int
+        snapshot_time, write_time: float
+        max_snapshot_time, max_write_time: float
+        last_snapshot_time, last_write_time: float
+
+    Methods:
+        request(sim)
+        take_error()
+        report()
+        close()
+    """
+    def __init__(self, filename):
+        self.filename = filename
+
+        self.pending = None
+        self.busy = False
+        self.closed = False
+        self.error = None
+
+        # How many snapshots were taken, skipped, written and failed to
+        # be written, and the total, longest and latest time (in seconds)
+        # each part took
+        self.snapshots = 0
+        self.skipped = 0
+        self.writes = 0
+        self.failures = 0
+
+        self.snapshot_time = 0.0
+        self.write_time = 0.0
+        self.max_snapshot_time = 0.0
+        self.max_write_time = 0.0
+        self.last_snapshot_time = 0.0
+        self.last_write_time = 0.0
+
+        self.condition = threading.Condition()
+
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def request(self, sim):
+        """
+        sim: simulation.Simulation
+        Takes a snapshot of sim and hands it to the worker to write.
+        Does nothing if the previous snapshot hasn't been written yet.
+        Returns True if a snapshot was taken.
+        Returns a bool.
+        """
+        with self.condition:
+            if self.busy or self.closed:
+                self.skipped += 1
+                return False
+
+            start = timeit.default_timer()
+            self.pending = Snapshot(sim)
+            elapsed = timeit.default_timer() - start
+
+            self.busy = True
+
+            self.snapshots += 1
+            self.snapshot_time += elapsed
+            self.max_snapshot_time = max(self.max_snapshot_time, elapsed)
+            self.last_snapshot_time = elapsed
+
+            self.condition.notify()
+
+        return True
+
+    def run(self):
+        """
+        The worker thread: writes each snapshot as it is handed over
+            until the autosaver is closed.
+        """
+        while True:
+            with self.condition:
+                while self.pending is None and not self.closed:
+                    self.condition.wait()
+
+                if self.pending is None:
+                    return
+
+                snapshot = self.pending
+                self.pending = None
+
+            start = timeit.default_timer()
+            error = None
+
+            try:
+                write(snapshot, self.filename)
+            except (IOError, OSError) as e:
+                error = e
+
+            elapsed = timeit.default_timer() - start
+
+            with self.condition:
+                self.busy = False
+
+                if error is not None:
+                    self.error = error
+                    self.failures += 1
+
+                self.writes += 1
+                self.write_time += elapsed
+                self.max_write_time = max(self.max_write_time, elapsed)
+                self.last_write_time = elapsed
+
+                self.condition.notify_all()
+
+    def take_error(self):
+        """
+        Returns the error of the last write that failed since this was
+            last called (or None if there wasn't one), and forgets it.
+        Returns an Exception or None.
+        """
+        with self.condition:
+            error = self.error
+            self.error = None
+
+        return error
+
+    def report(self):
+        """
+        Returns a summary of how many snapshots were taken, skipped,
+            written and failed, and the average and longest time taking
+            and writing them took, in milliseconds.
+        Returns a string.
+        """
+        with self.condition:
+            snapshot_average = self.snapshot_time / max(1, self.snapshots)
+            write_average = self.write_time / max(1, self.writes)
+
+            return ("%d snapshots (%d skipped): average %.2f ms, longest "
+                    "%.2f ms; %d writes (%d failed): average %.2f ms, "
+                    "longest %.2f ms" % (self.snapshots, self.skipped,
+                    snapshot_average * 1000, self.max_snapshot_time * 1000,
+                    self.writes, self.failures, write_average * 1000,
+                    self.max_write_time * 1000))
+
+    def close(self):
+        """
+        Waits for any snapshot being written to finish, then stops the
+            worker thread.
+        """
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+        self.thread.join()
@@ -0,0 +1,288 @@
+"""
+A server that hosts many games of "A solar system" in one process.
+Each connection is a session with its own Simulation, played with the
+same rules as the game's palette clicks, grid clicks and income ticks.
+One scheduler ticks every session together, every income interval.
+The server uses asyncio, so it needs Python 3.
+
+Clients talk to the server with fixed-size binary messages. A request
+is an op, a building id and a grid location:
+
+    request  op, building id, x, y
+
+The server answers each request in order, and pushes a message to
+every session on every income tick. Each message starts with its kind:
+
+    reply    kind, op, ok, income, power, placed buildings, ticks
+    tick     kind, unlock (NO_UNLOCK if none), delay (microseconds),
+             income, power, ticks
+    stats    kind, sessions, ticks, CPU time, tick work time,
+             longest delay (microseconds)
+
+The delay of a tick is how long after its scheduled time the session's
+message was sent.
+
+    python3 server.py [--host 127.0.0.1] [--port 8765]
+                      [--interval 5000] [--width 10] [--height 10]
+"""
+
+import argparse
+import asyncio
+import struct
+import sys
+import time
+import simulation
+
+
+REQUEST = struct.Struct('<BBHH')
+
+REPLY = struct.Struct('<BBBqqII')
+TICK = struct.Struct('<BBIqqI')
+STATS = struct.Struct('<BIIqqI')
+
+# Ops a client can ask for
+START = 1
+PICK = 2
+PLACE = 3
+STATUS = 4
+STATS_OP = 5
+
+# Kinds of message sent by the server
+REPLY_KIND = 1
+TICK_KIND = 2
+STATS_KIND = 3
+
+# Unlock index sent with a tick that unlocked nothing
+NO_UNLOCK = 255
+
+# Bytes a session's socket can have waiting to be sent before ticks
+# stop being pushed to it (its game carries on)
+MAX_BUFFERED = 64 * 1024
+
+
+class Session(object):
+    """
+    One game, played by one connection.
+    Attributes:
+        simulation: simulation.Simulation
+        writer: asyncio.StreamWriter
+
+    Methods:
+        handle(op, building_id, loc)
+        reply(op, ok)
+        tick(unlock, delay)
+    """
+    def __init__(self, width, height, writer):
+        self.simulation = simulation.Simulation(width, height,
+                sparse=width > 10 or height > 10)
+        self.writer = writer
+
+    def handle(self, op, building_id, loc):
+        """
+        op: int
+        building_id: int
+        loc: tuple (of ints)
+        Carries out a request with the same rules as the game: the game
+            is started by START, a building in the palette is paid for
+            by PICK (only while nothing is held), and the held building
+            is placed on an empty cell by PLACE.
+        Returns True if the request did anything.
+        Returns a bool.
+        """
+        sim = self.simulation
+
+        if op == START:
+            return sim.start()
+
+        if op == PICK:
+            if building_id not in sim.palette or sim.held is not None:
+                return False
+
+            return sim.pick(building_id)
+
+        if op == PLACE:
+            x, y = loc
+
+            if x >= sim.width or y >= sim.height:
+                return False
+
+            return sim.place(loc)
+
+        return op == STATUS
+
+    def reply(self, op, ok):
+        """
+        op: int
+        ok: bool
+        Sends the answer to a request, with the session's totals.
+        """
+        sim = self.simulation
+
+        self.writer.write(REPLY.pack(REPLY_KIND, op, ok, sim.income,
+                sim.power, sim.placed, sim.ticks))
+
+    def tick(self, unlock, delay):
+        """
+        unlock: int or None
+        delay: int
+        Sends an income tick, with any unlock and the tick's delay in
+            microseconds, unless the client has fallen behind reading.
+        """
+        if self.writer.transport.get_write_buffer_size() > MAX_BUFFERED:
+            return
+
+        sim = self.simulation
+
+        self.writer.write(TICK.pack(TICK_KIND,
+                NO_UNLOCK if unlock is None else unlock, delay, sim.income,
+                sim.power, sim.ticks))
+
+
+class GameServer(object):
+    """
+    Hosts game sessions and ticks them all on one schedule.
+    Attributes:
+        width, height: int
+        interval: int
+        sessions: set (of Sessions)
+        ticks: int
+        work_time: float
+        max_delay: float
+
+    Methods:
+        serve(reader, writer)
+        run_ticks()
+        stats()
+    """
+    def __init__(self, width=10, height=10,
+            interval=simulation.TICK_INTERVAL):
+        self.width = width
+        self.height = height
+        self.interval = interval
+
+        self.sessions = set()
+
+        # Ticks run, total time spent running them and the longest any
+        # session's tick was sent after its scheduled time (in seconds)
+        self.ticks = 0
+        self.work_time = 0.0
+        self.max_delay = 0.0
+
+    async def serve(self, reader, writer):
+        """
+        reader: asyncio.StreamReader
+        writer: asyncio.StreamWriter
+        Runs a session for a new connection until it closes.
+        """
+        session = Session(self.width, self.height, writer)
+        self.sessions.add(session)
+
+        try:
+            while True:
+                data = await reader.readexactly(REQUEST.size)
+                op, building_id, x, y = REQUEST.unpack(data)
+
+                if op == STATS_OP:
+                    writer.write(self.stats())
+                else:
+                    ok = session.handle(op, building_id, (x, y))
+                    session.reply(op, ok)
+
+                await writer.drain()
+
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+
+        finally:
+            self.sessions.discard(session)
+            writer.close()
+
+    async def run_ticks(self):
+        """
+        Ticks every session once every interval milliseconds, sending
+            each its income and any unlock.
+        A tick that starts late is run straight away, so the schedule
+            catches up rather than drifting.
+        """
+        loop = asyncio.get_event_loop()
+        interval = self.interval / 1000.0
+        due = loop.time() + interval
+
+        while True:
+            await asyncio.sleep(max(0.0, due - loop.time()))
+
+            start = loop.time()
+
+            for session in list(self.sessions):
+                unlock = session.simulation.step()
+
+                delay = loop.time() - due
+                session.tick(unlock, int(delay * 1000000))
+
+            self.ticks += 1
+            self.work_time += loop.time() - start
+            self.max_delay = max(self.max_delay, loop.time() - due)
+
+            due += interval
+
+    def stats(self):
+        """
+        Returns a stats message with the number of sessions, ticks run,
+            the process's CPU time, the time spent ticking and the
+            longest tick delay.
+        Returns a string of bytes.
+        """
+        return STATS.pack(STATS_KIND, len(self.sessions), self.ticks,
+                int(time.process_time() * 1000000),
+                int(self.work_time * 1000000),
+                int(self.max_delay * 1000000))
+
+
+async def run_server(host, port, server):
+    """
+    host: string
+    port: int
+    server: GameServer
+    Accepts connections and runs the tick scheduler until cancelled.
+    """
+    listener = await asyncio.start_server(server.serve, host, port)
+    ticks = asyncio.ensure_future(server.run_ticks())
+
+    try:
+        await ticks
+    finally:
+        ticks.cancel()
+        listener.close()
+        await listener.wait_closed()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Host many games at once.")
+    parser.add_argument('--host', default='127.0.0.1',
+            help="address to listen on (default: %(default)s)")
+    parser.add_argument('--port', type=int, default=8765,
+            help="port to listen on (default: %(default)s)")
+    parser.add_argument('--interval', type=int,
+            default=simulation.TICK_INTERVAL,
+            help="income tick length in milliseconds (default: %(default)s)")
+    parser.add_argument('--width', type=int, default=10,
+            help="grid width (default: %(default)s)")
+    parser.add_argument('--height', type=int, default=10,
+            help="grid height (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    if args.width < 1 or args.height < 1:
+        parser.error("the grid needs at least one row and column")
+
+    server = GameServer(args.width, args.height, args.interval)
+
+    try:
+        asyncio.run(run_server(args.host, args.port, server))
+    except KeyboardInterrupt:
+        pass
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,503 @@
+"""
+The rules of "A solar system", with no dependency on pygame.
+A Simulation owns the grid occupancy, power, income and unlocked
+buildings, so the game can be played (or analysed) without a display.
+"""
+
+import bisect
+import catalog
+import fields
+
+
+# Shorter names for the catalog's building types and ids
+POWER = catalog.POWER
+INCOME = catalog.INCOME
+
+EMPTY = catalog.EMPTY
+SOLAR_PANEL = catalog.SOLAR_PANEL
+HOUSE = catalog.HOUSE
+FACTORY = catalog.FACTORY
+SOLAR_FARM = catalog.SOLAR_FARM
+CORPORATION = catalog.CORPORATION
+SUN = catalog.SUN
+
+# Unlock tiers in the order they are unlocked (by income needed), and
+# the income needed for each
+UNLOCKS = catalog.UNLOCKS
+THRESHOLDS = [unlock.income for unlock in UNLOCKS]
+
+# Threshold used while there is nothing left to unlock
+NEVER = float('inf')
+
+# Income needed by the end of the game to win
+RICH = 1000000
+
+# Length of an income tick, in milliseconds
+TICK_INTERVAL = 5000
+
+# Where the abandoned solar panel is found on a grid big enough for it
+START_LOC = (4, 5)
+
+
+class Simulation(object):
+    """
+    The state of one game of "A solar system".
+    Attributes:
+        width, height: int
+        start_loc: tuple (of ints)
+        field: fields.ListField, fields.SparseField or fields.MappedField
+        placed: int
+        income_per_tick: int
+        power_generated, power_consumed: int
+        building_counts: list (of ints)
+        power, income: int
+        palette: list (of ints)
+        held: int or None
+        started: bool
+        ticks: int
+        next_threshold: int or float
+
+    Methods:
+        get_cell((x, y))
+        set_cell((x, y), building_id)
+        add_to_totals(building_id, n)
+        start()
+        pick(building_id)
+        place((x, y))
+        place_many(building_id, locs)
+        income_rate()
+        power_balance()
+        counts()
+        recount()
+        collect_income()
+        check_for_unlock()
+        step()
+        next_unlock()
+        update_next_unlock()
+        fast_forward(ticks)
+        fast_forward_time(milliseconds, interval=TICK_INTERVAL)
+        run(ticks)
+        is_full()
+        is_rich()
+    """
+    def __init__(self, width=10, height=10, start_loc=None, sparse=False):
+        if width < 1 or height < 1:
+            raise ValueError("a grid needs at least one row and column, "
+                    "not %dx%d" % (width, height))
+
+        self.width = width
+        self.height = height
+
+        if start_loc is None:
+            start_loc = get_start_loc(width, height)
+
+        self.start_loc = start_loc
+
+        # Building ids, one per cell, only stored for occupied chunks if
+        # sparse is True
+        values = len(catalog.INCOMES)
+
+        if sparse:
+            self.field = fields.SparseField(width, height, values,
+                    typecode='B')
+        else:
+            self.field = fields.ListField(width, height, values,
+                    typecode='B')
+
+        self.placed = 0
+
+        # Running totals over the placed buildings, kept by set_cell
+        self.income_per_tick = 0
+        self.power_generated = 0
+        self.power_consumed = 0
+        self.building_counts = [0] * len(catalog.INCOMES)
+
+        self.power = 0
+        self.income = 0
+
+        # Building ids available to pick, in palette order
+        self.palette = []
+
+        # Building id that has been paid for but not placed yet
+        self.held = None
+
+        self.started = False
+        self.ticks = 0
+
+        # Income needed for the next unlock, so a tick only has to make
+        # one comparison to know that nothing is unlocked
+        self.next_threshold = NEVER
+
+        # The game begins with an abandoned solar panel on the grid
+        self.set_cell(start_loc, SOLAR_PANEL)
+        self.power += catalog.BUILDINGS[SOLAR_PANEL].power
+
+    def get_cell(self, loc):
+        """
+        loc: tuple or list (of ints)
+        Returns the building id at grid location loc (EMPTY if none).
+        Returns an int.
+        """
+        x, y = loc
+        return self.field.get(x, y)
+
+    def set_cell(self, loc, building_id):
+        """
+        loc: tuple or list (of ints)
+        building_id: int
+        Puts a building on an empty cell and adds it to the running totals.
+        """
+        x, y = loc
+        self.field.set(x, y, building_id)
+        self.add_to_totals(building_id, 1)
+
+    def add_to_totals(self, building_id, n):
+        """
+        building_id: int
+        n: int
+        Adds n buildings of the given id to the running totals.
+        """
+        spec = catalog.BUILDINGS[building_id]
+
+        self.placed += n
+        self.building_counts[building_id] += n
+        self.income_per_tick += spec.income * n
+
+        if spec.building_type == POWER:
+            self.power_generated += spec.power * n
+        else:
+            self.power_consumed += spec.power * n
+
+    def start(self):
+        """
+        Starts the game by unlocking houses.
+        Returns False if the game had already started.
+        Returns a bool.
+        """
+        if self.started:
+            return False
+
+        self.started = True
+        self.palette.append(HOUSE)
+        self.update_next_unlock()
+
+        return True
+
+    def pick(self, building_id):
+        """
+        building_id: int
+        Pays for a building so that it can be placed.
+        Power generators cost income; income generators use up power.
+        Returns False if the building can't be paid for.
+        Returns a bool.
+        """
+        spec = catalog.BUILDINGS[building_id]
+
+        if spec.building_type == POWER:
+            if self.income < spec.cost:
+                return False
+
+            self.income -= spec.cost
+            self.power += spec.power
+
+        else:
+            if self.power < spec.power:
+                return False
+
+            self.power -= spec.power
+
+        self.held = building_id
+
+        return True
+
+    def place(self, loc):
+        """
+        loc: tuple or list (of ints)
+        Places the held building at grid location loc.
+        Returns False if nothing is held or the cell is taken.
+        Returns a bool.
+        """
+        if self.held is None or self.get_cell(loc) != EMPTY:
+            return False
+
+        self.set_cell(loc, self.held)
+        self.held = None
+
+        return True
+
+    def place_many(self, building_id, locs):
+        """
+        building_id: int
+        locs: list (of tuples or lists (of ints))
+        Pays for and places one building of the given id on each of the
+            given grid locations, skipping cells that are taken (or
+            listed twice).
+        The cost is checked and paid once for the whole batch, and the
+            running totals are updated once. If not every building can
+            be paid for, as many as can be are placed, in the order given.
+        Returns the locations that buildings were placed on.
+        Returns a list (of tuples).
+        """
+        spec = catalog.BUILDINGS[building_id]
+
+        free = []
+        seen = set()
+
+        for loc in locs:
+            loc = tuple(loc)
+
+            if loc not in seen and self.get_cell(loc) == EMPTY:
+                seen.add(loc)
+                free.append(loc)
+
+        # Power generators cost income; income generators use up power
+        if spec.building_type == POWER:
+            price, funds = spec.cost, self.income
+        else:
+            price, funds = spec.power, self.power
+
+        if price:
+            free = free[:funds // price]
+
+        n = len(free)
+
+        if n == 0:
+            return free
+
+        if spec.building_type == POWER:
+            self.income -= spec.cost * n
+            self.power += spec.power * n
+        else:
+            self.power -= spec.power * n
+
+        field = self.field
+
+        for x, y in free:
+            field.set(x, y, building_id)
+
+        self.add_to_totals(building_id, n)
+
+        return free
+
+    def income_rate(self):
+        """
+        Returns the income earned by all placed buildings in one tick.
+        Returns an int.
+        """
+        return self.income_per_tick
+
+    def power_balance(self):
+        """
+        Returns the power generated by all placed buildings minus the
+            power they use.
+        Returns an int.
+        """
+        return self.power_generated - self.power_consumed
+
+    def counts(self):
+        """
+        Returns the number of placed buildings of each building id.
+        Index 0 (EMPTY) holds the number of empty cells.
+        Returns a list (of ints) indexed by building id.
+        """
+        counts = list(self.building_counts)
+        counts[EMPTY] = self.width * self.height - self.placed
+
+        return counts
+
+    def recount(self):
+        """
+        Rebuilds the running totals from the field.
+        Only needed if the field was changed without using set_cell.
+        """
+        self.placed = 0
+        self.income_per_tick = 0
+        self.power_generated = 0
+        self.power_consumed = 0
+        self.building_counts = [0] * len(catalog.INCOMES)
+
+        for building_id, n in enumerate(self.field.counts()):
+            if building_id != EMPTY and n:
+                self.add_to_totals(building_id, n)
+
+    def collect_income(self):
+        """
+        Adds one tick's worth of income to the income total.
+        Returns the amount added.
+        Returns an int.
+        """
+        self.income += self.income_per_tick
+
+        return self.income_per_tick
+
+    def check_for_unlock(self):
+        """
+        Unlocks the next building if enough income has been earned and
+            the unlock's other conditions are met.
+        At most one building is unlocked per call.
+        Returns the index into UNLOCKS of the unlock, or None.
+        Returns an int or None.
+        """
+        if self.income < self.next_threshold:
+            return None
+
+        index = self.next_unlock()
+
+        if self.power < UNLOCKS[index].power:
+            return None
+
+        self.palette.append(UNLOCKS[index].building_id)
+        self.update_next_unlock()
+
+        return index
+
+    def step(self):
+        """
+        Advances the game by one income tick.
+        Nothing is earned until a building besides the starting solar
+            panel has been placed.
+        Returns the index into UNLOCKS of any unlock, or None.
+        Returns an int or None.
+        """
+        self.ticks += 1
+
+        if self.placed <= 1:
+            return None
+
+        self.collect_income()
+
+        return self.check_for_unlock()
+
+    def next_unlock(self):
+        """
+        Returns the index into UNLOCKS of the next building waiting to be
+            unlocked, or None if there isn't one.
+        Returns an int or None.
+        """
+        # The palette holds houses and then each building unlocked so far
+        index = len(self.palette) - 1
+
+        if not self.started or not 0 <= index < len(UNLOCKS):
+            return None
+
+        return index
+
+    def update_next_unlock(self):
+        """
+        Sets next_threshold to the income needed for the next unlock.
+        Needs to be called whenever the palette is changed without using
+            start or check_for_unlock.
+        """
+        index = self.next_unlock()
+
+        if index is None:
+            self.next_threshold = NEVER
+        else:
+            self.next_threshold = THRESHOLDS[index]
+
+    def fast_forward(self, ticks):
+        """
+        ticks: int
+        Advances the game by the given number of income ticks, with the
+            same result as calling step() that many times.
+        Income only changes by the same amount each tick between unlocks,
+            so the ticks up to each unlock are added up in one go.
+        Raises ValueError if ticks is negative, since the game can't run
+            backwards.
+        Returns the indexes into UNLOCKS of every unlock, in order.
+        Returns a list (of ints).
+        """
+        if ticks < 0:
+            raise ValueError("can't fast forward by %d ticks" % ticks)
+
+        self.ticks += ticks
+
+        if self.placed <= 1:
+            return []
+
+        unlocks = []
+        rate = self.income_per_tick
+
+        # Only the tiers up to the income at the end of the ticks can be
+        # reached, however many there are in the table
+        last = bisect.bisect_right(THRESHOLDS, self.income + rate * ticks)
+
+        while ticks > 0:
+            index = self.next_unlock()
+
+            if index is None or index >= last:
+                break
+
+            threshold = THRESHOLDS[index]
+
+            # Ticks until the income reaches the threshold; an unlock is
+            # only checked after a tick's income has been collected
+            if self.income + rate >= threshold:
+                needed = 1
+            elif rate == 0:
+                break
+            else:
+                needed = (threshold - self.income + rate - 1) // rate
+
+            # Power doesn't change while fast forwarding, so an unlock
+            # held back by it stays held back
+            if needed > ticks or self.power < UNLOCKS[index].power:
+                break
+
+            self.income += rate * needed
+            ticks -= needed
+
+            self.palette.append(UNLOCKS[index].building_id)
+            self.update_next_unlock()
+            unlocks.append(index)
+
+        self.income += rate * ticks
+
+        return unlocks
+
+    def fast_forward_time(self, milliseconds, interval=TICK_INTERVAL):
+        """
+        milliseconds: int
+        interval: int
+        Advances the game by as many whole income ticks of the given
+            length (in milliseconds) as fit in the given time.
+        Raises ValueError if milliseconds is negative.
+        Returns the indexes into UNLOCKS of every unlock, in order, and
+            the milliseconds left over.
+        Returns a tuple (list (of ints), int).
+        """
+        ticks, left_over = divmod(milliseconds, interval)
+
+        return (self.fast_forward(int(ticks)), left_over)
+
+    def run(self, ticks):
+        """
+        ticks: int
+        Advances the game by the given number of income ticks.
+        """
+        self.fast_forward(ticks)
+
+    def is_full(self):
+        """
+        Returns True if every cell of the grid holds a building.
+        Returns a bool.
+        """
+        return self.placed == self.width * self.height
+
+    def is_rich(self):
+        """
+        Returns True if enough income has been earned to win.
+        Returns a bool.
+        """
+        return self.income >= RICH
+
+
+def get_start_loc(width, height):
+    """
+    width, height: int
+    Returns where the abandoned solar panel starts on a grid of the
+        given size: START_LOC, moved in to the last column or row of a
+        grid too small to hold it.
+    Returns a tuple (of ints).
+    """
+    return (min(START_LOC[0], width - 1), min(START_LOC[1], height - 1))
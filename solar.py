@@ -1,34 +1,69 @@
 import pygame
+import argparse
+import os
+import sys
+import time
 import buildings
+import catalog
+import profiler
+import recording
+import savefile
+import simulation
 import ui
 
 
+# Timer events for income ticks, for frames held back by the render cap
+# and for autosaves
+INCOME_EVENT = pygame.USEREVENT
+RENDER_EVENT = pygame.USEREVENT + 1
+AUTOSAVE_EVENT = pygame.USEREVENT + 2
+
+
 class Game(object):
     """
     Main game object.
     Attributes:
         black, white, grey
         screen, screen_width, screen_height, screen_pos
-        clock
+        income_interval, max_fps
         mouse_sprite
-        background
+        painting, paint_start, paint_last, paint_cells
+        background, compositor
         grid, palette, status_bar
-        game_started, start_loc
+        hit_registry
+        simulation, start_loc
+        save_file, autosaver, autosave_interval, save_pending
+        profiler
+        recorder
 
     Methods:
         draw_mouse()
         draw_text(text)
-        add_building(grid, sprite, pos, status=None)
-        check_for_new_buildings()
+        draw_cell(grid, pos, status=None)
+        add_building(grid, building_id, pos, status=None)
+        place_batch(building_id, locs)
+        add_unlock(index)
+        catch_up(milliseconds)
         process_click(pos)
         process_grid_click(pos)
-        process_palette_click(sprite)
+        process_palette_click(building_id)
+        paint(pos)
+        finish_paint(pos, fill)
+        pan(dx, dy)
+        show_totals()
         start_game()
+        save()
+        check_save()
+        toggle_profiler()
         end_game()
         update_income()
+        handle_event(event)
         main()
     """
-    def __init__(self):
+    def __init__(self, grid_width=10, grid_height=10,
+            income_interval=simulation.TICK_INTERVAL, max_fps=60,
+            save_file=None, autosave_interval=60000, profile=False,
+            record_file=None):
         # Define colors
         self.black = (0, 0, 0)
         self.white = (255, 255, 255)
@@ -46,200 +81,343 @@ class Game(object):
                 )
         self.screen_pos = (0, 0)
 
+        # Pack every image into one display-format atlas, now that
+        # there is a display to convert it for
+        buildings.build_atlas()
+
         # Set title
         pygame.display.set_caption("A solar system")
 
-        # Set framerate object
-        self.clock = pygame.time.Clock()
+        # Set income tick length (in milliseconds) and the most frames
+        # to draw per second
+        self.income_interval = income_interval
+        self.max_fps = max_fps
 
         # Set object for drawing sprites on the mouse
         self.mouse_sprite = pygame.sprite.GroupSingle()
 
+        # Building id being painted across the grid by dragging after it
+        # was placed, the cell it was placed on, the last cell dragged
+        # over and the cells to paint
+        self.painting = None
+        self.paint_start = None
+        self.paint_last = None
+        self.paint_cells = []
+
         # Set background
         self.background = pygame.Surface(self.screen.get_size())
         self.background.convert()
         self.background.fill(self.black)
 
-        # Create Grid for the playing field
-        self.grid = ui.Grid(10, 10, x=100, color=self.grey, border=1)
+        # Continue the saved game, if there is one, and save it every
+        # autosave_interval milliseconds in the background
+        self.save_file = save_file
+        self.autosave_interval = autosave_interval
+        self.autosaver = None
 
-        # Set start of game conditions
-        self.game_started = False
+        # Whether a save asked for with S hasn't been written yet
+        self.save_pending = False
+        saved_at = None
+
+        if save_file is not None:
+            self.autosaver = savefile.Autosaver(save_file)
+
+        if save_file is not None and os.path.exists(save_file):
+            self.simulation, saved_at = savefile.load(save_file)
 
-        starting_panel = buildings.SolarPanel()
-        self.start_loc = (4, 5)
+            grid_width = self.simulation.width
+            grid_height = self.simulation.height
 
-        self.grid.add_sprite(starting_panel, self.start_loc)
+        # Fields larger than 10x10 only store the chunks that have
+        # buildings in them, and are scrolled through a 500x500 view
+        large = grid_width > 10 or grid_height > 10
+
+        # Set start of game conditions
+        if saved_at is None:
+            self.simulation = simulation.Simulation(grid_width, grid_height,
+                    sparse=large)
+
+        self.start_loc = self.simulation.start_loc
+
+        # Create Grid for the playing field, showing the simulation's
+        # field, so the buildings on the map are only stored once
+        if large:
+            self.grid = ui.ScrollingGrid(grid_width, grid_height, 500, 500,
+                    x=100, color=self.grey, border=1, fill=self.black,
+                    images=buildings.get_image, field=self.simulation.field)
+        else:
+            self.grid = ui.Grid(grid_width, grid_height, x=100,
+                    color=self.grey, border=1, fill=self.black,
+                    images=buildings.get_image, field=self.simulation.field)
 
         self.grid.draw(self.background)
 
-        # Create Grid for the palette
-        self.palette = ui.Grid(1, 6, x=25, y=25, y_spacing=25,
-                color=self.grey, border=1)
+        # Create Grid for the palette, with a cell for houses and one for
+        # each building that can be unlocked
+        self.palette = ui.Grid(1, len(simulation.UNLOCKS) + 1, x=25, y=25,
+                y_spacing=25, color=self.grey, border=1, fill=self.black,
+                images=buildings.get_image)
+
+        for i, building_id in enumerate(self.simulation.palette):
+            self.palette.add_building(building_id, (0, i))
 
         self.palette.draw(self.background)
 
+        if self.simulation.held is not None:
+            self.mouse_sprite.add(
+                    buildings.make_building(self.simulation.held))
+
         # Create StatusBar for displaying messages
         self.status_bar = ui.StatusBar(None, self.white)
-        self.status_bar.change_power(starting_panel.get_power())
+        self.status_bar.set_power(self.simulation.power)
+
+        # Register the clickable parts of the screen
+        self.hit_registry = ui.HitRegistry(self.screen_width,
+                self.screen_height)
+        self.hit_registry.register("grid", self.grid.get_bounds(), self.grid)
+        self.hit_registry.register("palette", self.palette.get_bounds(),
+                self.palette)
+        self.hit_registry.register("status_bar",
+                (0, 525, self.screen_width, self.screen_height - 525))
 
         # Draw background onto the screen
-        self.screen.blit(self.background, self.screen_pos)
-        pygame.display.update()
+        self.compositor = ui.Compositor(self.screen, self.background,
+                self.screen_pos)
+        self.compositor.add_all()
+
+        # Set frame timing, shown as an overlay while it is enabled
+        self.profiler = profiler.FrameProfiler()
+
+        if profile:
+            self.toggle_profiler()
+
+        # Record the input of a new game, so it can be replayed
+        self.recorder = None
+
+        if record_file is not None:
+            if saved_at is not None:
+                raise ValueError("only a new game can be recorded")
+
+            self.recorder = recording.Recorder(record_file, grid_width,
+                    grid_height)
 
         # Draw initial status
-        self.status_bar.set_status(
-                "You stumble upon an abandoned solar panel - "
-                       "maybe you can turn it on?"
-                )
+        if saved_at is None:
+            self.status_bar.set_status(
+                    "You stumble upon an abandoned solar panel - "
+                           "maybe you can turn it on?"
+                    )
+            self.draw_text(self.status_bar.status)
+            return
+
+        self.status_bar.set_status("Welcome back!")
         self.draw_text(self.status_bar.status)
 
+        if self.simulation.started:
+            self.show_totals()
+
+        # Pay out the income earned while the game was closed
+        self.catch_up(int((time.time() - saved_at) * 1000))
+
     def draw_mouse(self):
         """
-        Draws the mouse sprite on the cursor.
-        Covers the old position with the background image.
-        Uses dirty rect animation to only update the parts of the
-            screen that the mouse moves through.
+        Moves the mouse sprite to the cursor.
+        Marks the old and new positions as dirty if the mouse has moved,
+            so the compositor only redraws the parts of the screen that
+            the mouse moves through.
         """
         sprite = self.mouse_sprite.sprite
 
-        mouse_rects = []
-        mouse_rects.append(sprite.rect.copy())
+        pos = pygame.mouse.get_pos()
 
-        self.screen.blit(self.background, sprite.rect, sprite.rect)
+        if sprite.rect.center == pos:
+            return
 
-        pos = pygame.mouse.get_pos()
-        sprite.rect.center = pos
+        self.compositor.add(sprite.rect)
 
-        mouse_rects.append(sprite.rect)
+        sprite.rect.center = pos
 
-        self.mouse_sprite.draw(self.screen)
-        pygame.display.update(mouse_rects)
+        self.compositor.add(sprite.rect)
 
     def draw_text(self, text):
         """
-        Draws the given status objects to the screen.
-        Covers the old position with black filler.
-        Uses dirty rect animation to only update the parts of the
-            screen that contain the text.
+        Draws the given status objects to the background.
+        Covers the old position with black.
+        Marks the old and new positions as dirty, so the compositor only
+            redraws the parts of the screen that contain the text.
         """
         old_pos = text.get_old_pos()
         pos = text.get_pos()
 
-        rects = []
-        rects.append(old_pos)
+        self.background.fill(self.black, old_pos)
+        self.background.blit(text.get_text(), pos)
 
-        filler = pygame.Surface((self.screen_width, self.screen_height))
-        filler.fill(self.black)
+        self.compositor.add(old_pos)
+        self.compositor.add(pos)
 
-        self.background.blit(filler, old_pos, old_pos)
+    def draw_cell(self, grid, pos, status=None):
+        """
+        Draws the building in a grid cell and the border of the cell.
+        Marks the cell as dirty, so the compositor only redraws that
+            part of the screen.
+        Draws a status message to the screen (if one is provided).
+        """
+        self.compositor.add(grid.draw_cell(self.background, pos))
 
-        rects.append(pos)
+        if status is not None:
+            self.status_bar.set_status(status)
+            self.draw_text(self.status_bar.status)
 
-        self.background.blit(text.get_text(), pos)
-        self.screen.blit(self.background, self.screen_pos)
+    def add_building(self, grid, building_id, pos, status=None):
+        """
+        Adds a building to a grid, such as the palette, that keeps its
+            own cells, and draws it.
+        Draws a status message to the screen (if one is provided).
+        """
+        grid.add_building(building_id, pos)
 
-        pygame.display.update(rects)
+        self.draw_cell(grid, pos, status)
 
-    def add_building(self, grid, sprite, pos, status=None):
+    def place_batch(self, building_id, locs):
         """
-        Adds a sprite to a grid.
-        Draws the sprite and the grid it's inside.
-        Uses dirty rect animation to only update the part of the
-            screen that contains the sprite and its grid cell.
-        Draws a status message to the screen (if one is provided).
+        Places one building of the given id on each of the given grid
+            cells that is empty, as many as can be paid for, as one batch.
+        The simulation pays for, places and counts the whole batch at
+            once, in the field the grid shows, and the cells are marked
+            dirty as one rect, so the compositor redraws them in a single
+            update.
+        Draws one status message and the new totals.
+        Returns the cells that buildings were placed on.
         """
+        placed = self.simulation.place_many(building_id, locs)
+        spec = catalog.BUILDINGS[building_id]
+
+        if not placed:
+            empty = [loc for loc in locs
+                    if self.simulation.get_cell(loc) == simulation.EMPTY]
+
+            if empty and spec.building_type == simulation.POWER:
+                self.status_bar.set_status("You cannot afford that!")
+                self.draw_text(self.status_bar.status)
+
+            elif empty:
+                self.status_bar.set_status("You don't have the power!")
+                self.draw_text(self.status_bar.status)
+
+            return placed
+
         rects = []
-        rects.append(sprite.rect.copy())
 
-        grid.add_sprite(sprite, pos)
+        for loc in placed:
+            rects.append(self.grid.draw_cell(self.background, loc))
 
-        rects.append(sprite.rect)
+        area = rects[0].unionall(rects[1:]).clip(self.grid.get_bounds())
+        self.compositor.add(area)
 
-        grid.draw(self.background)
-        self.screen.blit(self.background, self.screen_pos)
+        name = plural(spec.name.lower())
 
-        pygame.display.update(rects)
+        if spec.building_type == simulation.POWER:
+            self.status_bar.set_status("You built %d more %s!" %
+                    (len(placed), name))
 
-        if status is not None:
-            self.status_bar.set_status(status)
-            self.draw_text(self.status_bar.status)
+            self.status_bar.set_income(self.simulation.income)
+            self.draw_text(self.status_bar.income)
 
-    def check_for_new_buildings(self):
+        else:
+            self.status_bar.set_status("You powered %d more %s!" %
+                    (len(placed), name))
+
+        self.draw_text(self.status_bar.status)
+
+        self.status_bar.set_power(self.simulation.power)
+        self.draw_text(self.status_bar.power)
+
+        if self.simulation.is_full():
+            self.end_game()
+
+        return placed
+
+    def add_unlock(self, index):
         """
-        Checks to see whether more buildings should be added to the palette.
-        If so, add them.
-        New buildings are added based on the income accumulated so far and
-            what buildings are already in the palette.
-        A status message is provided when the building is added.
+        Adds the building unlocked by UNLOCKS[index] to the palette, in
+            the palette cell matching its place in the simulation's
+            palette, and shows the unlock's status message.
         """
-        income = self.status_bar.get_income()
-        n = len(self.palette.items)
+        unlock = simulation.UNLOCKS[index]
+        pos = (0, self.simulation.palette.index(unlock.building_id))
 
-        if n == 1 and income >= 100:
-            self.add_building(self.palette, buildings.SolarPanel(), (0, 1),
-                    status="You have learned to build solar panels!")
+        self.add_building(self.palette, unlock.building_id, pos,
+                status=unlock.message)
 
-        if n == 2 and income >= 500:
-            self.add_building(self.palette, buildings.Factory(), (0, 2),
-                    status="You can now power factories!")
+    def catch_up(self, milliseconds):
+        """
+        Advances the game by the income ticks that fit in the given time
+            all at once, such as after a stall or time away.
+        A negative time (such as from a save made by a clock that was
+            ahead) counts as no time at all.
+        Shows every building unlocked along the way and the new income.
+        Returns the milliseconds left over.
+        """
+        milliseconds = max(0, milliseconds)
 
-        if n == 3 and income >= 10000:
-            self.add_building(self.palette, buildings.SolarFarm(), (0, 3),
-                    status="You have learned to build solar farms!")
+        unlocks, left_over = self.simulation.fast_forward_time(milliseconds,
+                self.income_interval)
 
-        if n == 4 and income >= 50000:
-            self.add_building(self.palette, buildings.Corporation(), (0, 4),
-                    status="You can now power corporations!")
+        for index in unlocks:
+            self.add_unlock(index)
 
-        if n == 5 and income >= 1000000:
-            self.add_building(self.palette, buildings.Sun(), (0, 5),
-                    status="You have learned to harvest the Sun!")
+        self.status_bar.set_income(self.simulation.income)
+        self.draw_text(self.status_bar.income)
+
+        return left_over
 
     def process_click(self, pos):
         """
         Decides what to do when the mouse is clicked.
+        Uses the hit registry to find the region and cell under pos.
         If no sprite is on the cursor:
             Check if the game has started and start it if not.
             Check if there was a click on the palette and process it if so.
         If there is a sprite on the cursor:
             Check if there was a click on the grid and process it if so.
         """
-        if len(self.mouse_sprite) == 0:
-            if not self.game_started:
-                loc = self.grid.get_loc(pos)
+        hit = self.hit_registry.resolve(pos)
 
-                if loc == self.start_loc:
-                    self.start_game()
+        if hit is None:
+            return
 
-            else:
-                loc = self.palette.get_loc(pos)
+        region, loc = hit
 
-                if loc is not None:
-                    sprite = self.palette.get_cell(loc)
-                    self.process_palette_click(sprite)
+        if loc is None:
+            return
 
-        elif len(self.mouse_sprite) == 1:
-            loc = self.grid.get_loc(pos)
+        if len(self.mouse_sprite) == 0:
+            if not self.simulation.started:
+                if region == "grid" and loc == self.start_loc:
+                    self.start_game()
+
+            elif region == "palette":
+                self.process_palette_click(self.palette.get_cell(loc))
 
-            if loc is not None:
+        elif len(self.mouse_sprite) == 1:
+            if region == "grid":
                 self.process_grid_click(loc)
 
     def process_grid_click(self, pos):
         """
         Determines whether to place the mouse sprite onto the grid.
         If the cell at the provided position is empty:
-            Add the building to the grid.
+            Place the building in the simulation and draw it on the grid.
             Use the sprite's name and type to send a status message
                 about the new addition.
             Empty the mouse_sprite object.
         """
-        if self.grid.get_cell(pos) is None:
+        if self.simulation.place(pos):
             sprite = self.mouse_sprite.sprite
 
             name = sprite.name.lower()
 
-            if sprite.get_building_type() == 1:
+            if sprite.get_building_type() == simulation.POWER:
                 if name == "sun":
                     status = "You have harnessed the power of the Sun!"
                 else:
@@ -248,14 +426,22 @@ class Game(object):
             else:
                 status = "You powered a " + str(name) + "!"
 
-            self.add_building(self.grid, sprite, pos, status)
-
+            # The sprite only follows the cursor; the grid shows the id
+            # the simulation has just put in its field
+            self.compositor.add(sprite.rect)
             self.mouse_sprite.empty()
 
-    def process_palette_click(self, sprite):
+            self.draw_cell(self.grid, pos, status)
+
+            # Dragging on from here paints more of the same building
+            self.painting = sprite.building_id
+            self.paint_start = self.paint_last = pos
+            self.paint_cells = []
+
+    def process_palette_click(self, building_id):
         """
-        Determines whether to add a palette sprite to the cursor.
-        If there was no sprite provided, do nothing.
+        Determines whether to add a palette building to the cursor.
+        If the palette cell was empty (building id 0), do nothing.
         If the building is a power generator (type 1):
             If there is enough income to cover the cost of the building:
                 Subtract the cost from the total income.
@@ -263,63 +449,202 @@ class Game(object):
                 Add the sprite to the mouse_sprite object.
             If there is not enough income to cover the cost:
                 Set the status to inform the user.
-        If the sprite is an income generator (not type 1):
+        If the building is an income generator (not type 1):
             If there is sufficient power to power the building:
                 Subtract the power cost from the power pool.
             If there is insufficient power:
                 Set the status to inform the user.
         """
-        if sprite is None:
+        if building_id == simulation.EMPTY:
             return
 
-        sprite = type(sprite)()
+        spec = catalog.BUILDINGS[building_id]
 
-        if sprite.building_type == 1:
-            if self.status_bar.get_income() >= sprite.cost:
-                self.status_bar.change_income(-sprite.cost)
+        if self.simulation.pick(building_id):
+            if spec.building_type == simulation.POWER:
+                self.status_bar.set_income(self.simulation.income)
                 self.draw_text(self.status_bar.income)
 
-                self.status_bar.change_power(sprite.power)
-                self.draw_text(self.status_bar.power)
+            self.status_bar.set_power(self.simulation.power)
+            self.draw_text(self.status_bar.power)
 
-                self.mouse_sprite.add(sprite)
+            self.mouse_sprite.add(buildings.make_building(building_id))
 
-            else:
-                self.status_bar.set_status("You cannot afford that!")
-                self.draw_text(self.status_bar.status)
+        elif spec.building_type == simulation.POWER:
+            self.status_bar.set_status("You cannot afford that!")
+            self.draw_text(self.status_bar.status)
 
         else:
-            if self.status_bar.get_power() >= sprite.power:
-                self.status_bar.change_power(-sprite.power)
-                self.draw_text(self.status_bar.power)
+            self.status_bar.set_status("You don't have the power!")
+            self.draw_text(self.status_bar.status)
 
-                self.mouse_sprite.add(sprite)
+    def paint(self, pos):
+        """
+        Adds the grid cells between the last cell dragged over and the
+            cell under pos to the cells to paint, while painting.
+        Each new cell shows the building being painted (inside the
+            grid's bounds) until the drag ends; nothing is paid for or
+            placed before then.
+        """
+        if self.painting is None:
+            return
 
-            else:
-                self.status_bar.set_status("You don't have the power!")
-                self.draw_text(self.status_bar.status)
+        loc = self.grid.get_loc(pos)
+
+        if loc is None or loc == self.paint_last:
+            return
+
+        if self.recorder is not None:
+            self.recorder.record(recording.PAINT, *pos)
+
+        image = buildings.get_image(self.painting)
+
+        # Cells at the edge of a scrolling grid's view are partly outside
+        # it, so keep the preview from drawing over anything around it
+        bounds = self.grid.get_bounds()
+        clip = self.background.get_clip()
+        self.background.set_clip(bounds)
+
+        for cell in ui.line_cells(self.paint_last, loc)[1:]:
+            if self.grid.get_cell(cell) == simulation.EMPTY:
+                rect = self.grid.get_rect(cell)
+                self.background.blit(image, rect)
+                self.compositor.add(rect.clip(bounds))
+
+            self.paint_cells.append(cell)
+
+        self.background.set_clip(clip)
+
+        self.paint_last = loc
+
+    def finish_paint(self, pos, fill):
+        """
+        Ends a drag that started by placing a building.
+        If fill is True, places the building on every cell of the
+            rectangle from where the drag started to the cell under pos
+            (or the last cell dragged over).
+        Otherwise places it on every cell that was dragged over.
+        Either way the cells are placed as one batch.
+        """
+        if self.painting is None:
+            return
+
+        if self.recorder is not None:
+            self.recorder.record(recording.FILL if fill else recording.RELEASE,
+                    *pos)
+
+        building_id = self.painting
+        self.painting = None
+
+        if fill:
+            corner = self.grid.get_loc(pos) or self.paint_last
+            locs = ui.rect_cells(self.paint_start, corner)
+        else:
+            locs = self.paint_cells
+
+        self.place_batch(building_id, locs)
+
+        # Clear any cell that was shown while dragging but not placed
+        for cell in self.paint_cells:
+            if self.grid.get_cell(cell) == simulation.EMPTY:
+                rect = self.grid.draw_cell(self.background, cell)
+                self.compositor.add(rect)
+
+        self.paint_cells = []
+
+    def pan(self, dx, dy):
+        """
+        Moves the camera of a scrolling grid by (dx, dy) pixels and
+            redraws the view. Does nothing for a grid that isn't scrolling.
+        """
+        if not isinstance(self.grid, ui.ScrollingGrid):
+            return
+
+        if self.recorder is not None:
+            self.recorder.record(recording.PAN, dx, dy)
+
+        if self.grid.move_camera((dx, dy)):
+            self.grid.draw(self.background)
+            self.compositor.add(self.grid.get_bounds())
 
     def start_game(self):
         """
         Starts the game when the initial solar panel is clicked.
         Adds a House object to the palette and draws the status bar
-            to the screen. Updates the entire display.
+            to the screen.
         """
-        self.game_started = True
+        self.simulation.start()
 
-        house = buildings.House()
-        self.add_building(self.palette, house, (0, 0),
+        self.add_building(self.palette, self.simulation.palette[0], (0, 0),
                 status="You can now power houses!")
 
+        self.show_totals()
+
+    def show_totals(self):
+        """
+        Draws the power and income labels and totals to the screen.
+        """
         self.status_bar.draw_labels(self.background)
-        self.screen.blit(self.background, self.screen_pos)
+        self.compositor.add(self.status_bar.power_label.get_pos())
+        self.compositor.add(self.status_bar.income_label.get_pos())
 
         self.draw_text(self.status_bar.power)
 
-        self.status_bar.change_income(0)
+        self.status_bar.set_income(self.simulation.income)
         self.draw_text(self.status_bar.income)
 
-        pygame.display.update()
+    def save(self):
+        """
+        Saves the game to the save file (if there is one) in the
+            background, using the autosaver.
+        check_save says when the save has been written.
+        """
+        if self.autosaver is None:
+            return
+
+        if self.autosaver.request(self.simulation):
+            self.save_pending = True
+            self.status_bar.set_status("Saving...")
+        else:
+            self.status_bar.set_status("Still saving...")
+
+        self.draw_text(self.status_bar.status)
+
+    def check_save(self):
+        """
+        Shows the error if a background save has failed since the last
+            check, or that the game was saved once a save asked for with
+            save() has been written.
+        """
+        error = self.autosaver.take_error()
+
+        if error is not None:
+            self.save_pending = False
+
+            reason = getattr(error, 'strerror', None) or error
+            self.status_bar.set_status("Couldn't save: %s" % reason)
+            self.draw_text(self.status_bar.status)
+
+        elif self.save_pending and not self.autosaver.busy:
+            self.save_pending = False
+
+            self.status_bar.set_status("Game saved.")
+            self.draw_text(self.status_bar.status)
+
+    def toggle_profiler(self):
+        """
+        Turns frame timing and its overlay on or off.
+        """
+        if self.profiler.enabled:
+            self.profiler.disable(self)
+            self.profiler.overlay = False
+
+            # Cover the overlay back up
+            self.compositor.add(self.profiler.overlay_rect)
+
+        else:
+            self.profiler.enable(self)
+            self.profiler.overlay = True
 
     def end_game(self):
         """
@@ -328,7 +653,7 @@ class Game(object):
             of the screen depending on how much income has been
             accumulated so far.
         """
-        if self.status_bar.get_income() >= 1000000:
+        if self.simulation.is_rich():
             end_text = "You're rich!"
 
         else:
@@ -340,60 +665,337 @@ class Game(object):
 
     def update_income(self):
         """
-        Gets the sum of the income from all of the buildings
-            that generate income and increases the total income
-            by that amount.
+        Advances the simulation by one income tick, which adds the income
+            from all of the buildings that generate income to the total
+            income and unlocks the next building once enough has been
+            earned.
+        Shows the new income and any building unlocked, once something
+            has been placed (nothing is earned before then).
         """
-        income = 0
+        index = self.simulation.step()
 
-        for building in self.grid.items:
-            if building.get_building_type() != 1:
-                income += building.income
+        if self.simulation.placed <= 1:
+            return
 
-        self.status_bar.change_income(income)
+        self.status_bar.set_income(self.simulation.income)
         self.draw_text(self.status_bar.income)
 
-    def main(self):
+        if index is not None:
+            self.add_unlock(index)
+
+    def handle_event(self, event):
         """
-        Main game loop.
-        Ends when the window is closed.
         Determines what should be done when the left mouse
             button is pressed down.
-        Draws the mouse if there is an object in the mouse group.
-        Updates the income and checks for new buildings every
-            5 seconds (20 fps means 100 ticks per 5 seconds).
+        Paints the building just placed across the grid by dragging
+            with the left mouse button, or fills a rectangle of it if
+            shift is held when the button is let go.
+        Pans a scrolling grid with the arrow keys or by dragging with
+            the right mouse button.
+        Saves the game in the background when S is pressed or the
+            autosave timer fires, first showing any error from the last
+            background save.
+        Toggles the profiler with F3 and writes its frames to
+            profile.csv with F4.
+        Advances the simulation by an income tick when the income timer
+            fires.
         Ends the game once the grid is full of buildings.
+        Clicks, pans and income ticks are recorded while recording.
+        Returns True if the window was closed.
+        """
+        if event.type == pygame.QUIT:
+            return True
+
+        if event.type == pygame.MOUSEBUTTONDOWN and event.button == 1:
+            if self.recorder is not None:
+                self.recorder.record(recording.CLICK, *event.pos)
+
+            if not self.simulation.is_full():
+                self.process_click(event.pos)
+
+                if self.simulation.is_full():
+                    self.end_game()
+
+        if event.type == pygame.MOUSEMOTION and event.buttons[0]:
+            self.paint(event.pos)
+
+        if event.type == pygame.MOUSEBUTTONUP and event.button == 1:
+            fill = bool(pygame.key.get_mods() & pygame.KMOD_SHIFT)
+            self.finish_paint(event.pos, fill)
+
+        if event.type == pygame.MOUSEMOTION and event.buttons[2]:
+            self.pan(-event.rel[0], -event.rel[1])
+
+        if event.type == pygame.KEYDOWN:
+            if event.key == pygame.K_LEFT:
+                self.pan(-self.grid.x_scale, 0)
+            elif event.key == pygame.K_RIGHT:
+                self.pan(self.grid.x_scale, 0)
+            elif event.key == pygame.K_UP:
+                self.pan(0, -self.grid.y_scale)
+            elif event.key == pygame.K_DOWN:
+                self.pan(0, self.grid.y_scale)
+            elif event.key == pygame.K_s:
+                self.save()
+            elif event.key == pygame.K_F3:
+                self.toggle_profiler()
+            elif event.key == pygame.K_F4 and self.profiler.enabled:
+                self.profiler.write_csv('profile.csv')
+
+        if event.type == INCOME_EVENT and self.recorder is not None:
+            self.recorder.tick()
+
+        if event.type == INCOME_EVENT:
+            self.update_income()
+
+            if self.simulation.placed > 1 and self.simulation.is_full():
+                self.end_game()
+
+        if event.type == RENDER_EVENT:
+            pygame.time.set_timer(RENDER_EVENT, 0)
+
+        if event.type == AUTOSAVE_EVENT:
+            self.check_save()
+            self.autosaver.request(self.simulation)
+
+        return False
+
+    def main(self):
+        """
+        Main game loop.
+        Ends when the window is closed.
+        Sleeps until there is an event to handle, then handles every
+            queued event.
+        Moves the mouse sprite when the mouse moves.
+        Advances the simulation by an income tick every income_interval
+            milliseconds, using a timer event.
+        Autosaves every autosave_interval milliseconds, and saves once
+            more before the loop ends. Save errors are shown as they are
+            found, and printed with the autosave timings at the end.
+        Draws only when something has changed, at most max_fps times
+            a second.
+        Times each frame while the profiler is enabled.
         """
         done = False
-        count = 20
+        last_frame = -1000
+
+        pygame.time.set_timer(INCOME_EVENT, self.income_interval)
+
+        if self.autosaver is not None:
+            pygame.time.set_timer(AUTOSAVE_EVENT, self.autosave_interval)
 
         while not done:
-            for event in pygame.event.get():
-                if event.type == pygame.QUIT:
-                    done = True
+            # Block until something happens, then handle everything queued
+            events = [pygame.event.wait()] + pygame.event.get()
 
-                if event.type == pygame.MOUSEBUTTONDOWN:
-                    if len(self.grid.items) < 100:
-                        pos = pygame.mouse.get_pos()
-                        self.process_click(pos)
+            self.profiler.begin_frame()
 
-            count += 1
+            for event in events:
+                if self.handle_event(event):
+                    done = True
+
+            if self.save_pending:
+                self.check_save()
 
             if len(self.mouse_sprite) == 1:
                 self.draw_mouse()
 
-            if len(self.grid.items) > 1 and count % 100 == 0:
-                self.update_income()
-                self.check_for_new_buildings()
+            flushed = False
 
-            if len(self.grid.items) == 100:
-                self.end_game()
+            if self.compositor.dirty:
+                # Hold the frame back until the render cap allows it
+                wait = (last_frame + 1000 // self.max_fps -
+                        pygame.time.get_ticks())
 
-            self.clock.tick(20)
+                if wait > 0:
+                    pygame.time.set_timer(RENDER_EVENT, wait)
+                else:
+                    self.compositor.flush(self.mouse_sprite)
+                    last_frame = pygame.time.get_ticks()
+                    flushed = True
+
+            if flushed:
+                self.profiler.end_frame(self.compositor.frame_blits,
+                        self.compositor.frame_pixels)
+            else:
+                self.profiler.end_frame(0, 0)
 
+            if flushed and self.profiler.overlay:
+                rect = self.profiler.draw_overlay(self.screen)
+                pygame.display.update(rect)
+
+        pygame.time.set_timer(INCOME_EVENT, 0)
+        pygame.time.set_timer(RENDER_EVENT, 0)
+        pygame.time.set_timer(AUTOSAVE_EVENT, 0)
+
+        # Let any background save finish, then save the final state
+        if self.autosaver is not None:
+            self.autosaver.close()
+
+            error = self.autosaver.take_error()
+
+            if error is not None:
+                print("The last autosave failed: %s" % error)
+
+            try:
+                savefile.save(self.simulation, self.save_file)
+            except (IOError, OSError) as error:
+                print("Couldn't save the game: %s" % error)
+
+            print("Autosave: %s" % self.autosaver.report())
+
+        if self.recorder is not None:
+            self.recorder.close(self.simulation)
+
+
+def plural(name):
+    """
+    name: string
+    Returns the plural of a building name.
+    Returns a string.
+    """
+    if name.endswith('y'):
+        return name[:-1] + 'ies'
+
+    return name + 's'
+
+
+def replay(filename):
+    """
+    filename: string
+    Replays a recording as fast as possible, without waiting for timers
+        or drawing to the screen, by handing its clicks, drags and income
+        ticks to a new Game in the order they were recorded.
+    pygame has to be initialized first.
+    Returns the final state of the replay and of the recording (None if
+        the recording never ended), as recording.final_state returns it.
+    Returns a tuple (tuple, tuple or None).
+    """
+    width, height, events, final = recording.read(filename)
+
+    game = Game(width, height)
+    ticks = 0
+
+    income = pygame.event.Event(INCOME_EVENT)
+
+    for tick, kind, x, y in events:
+        while ticks < tick:
+            game.handle_event(income)
+            game.compositor.discard()
+            ticks += 1
+
+        if kind == recording.CLICK:
+            game.handle_event(pygame.event.Event(pygame.MOUSEBUTTONDOWN,
+                    button=1, pos=(x, y)))
+
+        elif kind == recording.PAN:
+            game.pan(x, y)
+
+        elif kind == recording.PAINT:
+            game.paint((x, y))
+
+        elif kind in (recording.RELEASE, recording.FILL):
+            game.finish_paint((x, y), kind == recording.FILL)
+
+        # Nothing is shown, so don't keep the parts of the screen that
+        # would have been redrawn
+        game.compositor.discard()
+
+    # Finish with the ticks after the last event
+    if final is not None:
+        while ticks < final[0]:
+            game.handle_event(income)
+            game.compositor.discard()
+            ticks += 1
+
+    return (recording.final_state(game.simulation, ticks), final)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="A solar system.")
+    parser.add_argument('args', nargs='*', metavar='[width height] [save]',
+            help="grid size and save file (both optional)")
+    parser.add_argument('--record', metavar='FILE',
+            help="record the input of a new game to a file")
+    parser.add_argument('--replay', metavar='FILE',
+            help="replay a recording without a window and check that it "
+            "ends the same way")
+    options = parser.parse_args(argv)
+
+    args = options.args
+    save_file = None
+
+    if len(args) % 2 == 1:
+        save_file = args.pop()
+
+    if len(args) not in (0, 2):
+        parser.error("expected a width and a height")
+
+    if options.record is not None and save_file is not None:
+        parser.error("only a new game can be recorded")
+
+    if options.replay is not None:
+        # The dummy video driver has to be chosen before pygame starts
+        os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+        pygame.init()
+
+        start = time.time()
+        state, final = replay(options.replay)
+        elapsed = time.time() - start
+
+        pygame.quit()
+
+        print("Replayed %d income ticks in %.3f seconds" %
+                (state[0], elapsed))
+
+        if final is None:
+            print("The recording has no final state to check against")
+            return 0
+
+        names = ['income ticks', 'income', 'power', 'placed buildings',
+                'cells CRC', 'palette length', 'palette']
+        mismatched = False
+
+        for name, replayed, recorded in zip(names, state, final):
+            if replayed != recorded:
+                print("%s: recorded %r, replayed %r" %
+                        (name, recorded, replayed))
+                mismatched = True
+
+        if mismatched:
+            return 1
+
+        print("Final state matches the recording")
+        return 0
 
-if __name__ == '__main__':
     pygame.init()
-    game = Game()
+
+    width, height = 10, 10
+
+    if len(args) == 2:
+        try:
+            width, height = int(args[0]), int(args[1])
+        except ValueError:
+            parser.error("the width and height have to be whole numbers")
+
+        if width < 1 or height < 1:
+            parser.error("the grid needs at least one row and column")
+
+    try:
+        game = Game(width, height, save_file=save_file,
+                record_file=options.record)
+    except savefile.SaveFileError as error:
+        pygame.quit()
+        parser.error(str(error))
+
     game.main()
     pygame.quit()
+
+    return 0
+
+
+if __name__ == '__main__':
+    # Optional grid size and save file:
+    # python solar.py [width height] [save file] [--record FILE]
+    # python solar.py --replay FILE
+    sys.exit(main())
@@ -0,0 +1,303 @@
+"""
+A parameter sweep for balancing "A solar system".
+Simulates the economy for thousands of sets of building costs, incomes,
+power values, unlock thresholds and tick lengths at once. The state of
+every parameter set is one row of a NumPy array, and all of the rows
+are stepped in lockstep, a tick at a time.
+
+Every parameter set is played with the same simple strategy. Each tick
+it buys one building before the income is collected: the newest
+income building there is power for, or failing that the newest power
+building it can afford.
+
+Row 0 always holds the current rules from the catalog. The other rows
+scale each value by a random factor within the given spread. The ticks
+(and seconds) each parameter set takes to reach every unlock and
+$1,000,000 are written as CSV, with a summary printed at the end.
+
+    python sweep.py [--configs 10000] [--spread 0.5] [--seed 0]
+                    [--max-ticks 5000] [--output sweep.csv]
+"""
+
+import argparse
+import csv
+import sys
+import timeit
+import catalog
+import simulation
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# Building ids that have a column in the parameter arrays
+BUILDING_IDS = sorted(catalog.BUILDINGS)
+
+# The buildings unlocked by each tier, in order
+TIER_IDS = [unlock.building_id for unlock in simulation.UNLOCKS]
+
+
+def base_parameters():
+    """
+    Returns the current rules as parameters: the cost, income and power
+        of each building id, the income threshold of each unlock tier
+        and the tick length, in milliseconds.
+    Returns a dict (of numpy.ndarrays).
+    """
+    size = len(catalog.INCOMES)
+
+    cost = numpy.zeros(size, dtype=numpy.int64)
+    income = numpy.zeros(size, dtype=numpy.int64)
+    power = numpy.zeros(size, dtype=numpy.int64)
+
+    for building_id in BUILDING_IDS:
+        spec = catalog.BUILDINGS[building_id]
+
+        cost[building_id] = spec.cost
+        income[building_id] = spec.income
+        power[building_id] = spec.power
+
+    return {
+        'cost': cost,
+        'income': income,
+        'power': power,
+        'threshold': numpy.array(simulation.THRESHOLDS, dtype=numpy.int64),
+        'interval': numpy.array(simulation.TICK_INTERVAL, dtype=numpy.int64),
+        }
+
+
+def sample_parameters(configs, spread, seed=0):
+    """
+    configs: int
+    spread: float
+    seed: int
+    Makes configs parameter sets. The first is the current rules; each
+        value of the others is the current value scaled by a random
+        factor from 1 - spread to 1 + spread, rounded.
+    Returns a dict (of numpy.ndarrays with one row per parameter set).
+    """
+    rng = numpy.random.RandomState(seed)
+    params = {}
+
+    for name, value in sorted(base_parameters().items()):
+        rows = numpy.tile(value, (configs,) + (1,) * value.ndim)
+        factors = rng.uniform(1 - spread, 1 + spread, rows.shape)
+        factors[0] = 1
+
+        rows = numpy.rint(rows * factors).astype(numpy.int64)
+
+        # Ticks have to have some length
+        if name == 'interval':
+            rows = numpy.maximum(rows, 1)
+
+        params[name] = rows
+
+    return params
+
+
+def run(params, max_ticks=5000, cells=99):
+    """
+    params: dict (of numpy.ndarrays)
+    max_ticks: int
+    cells: int
+    Plays every parameter set for up to max_ticks income ticks on a
+        grid with the given number of free cells, stopping early once
+        every set has unlocked everything and earned $1,000,000.
+    Returns the tick each set reached each unlock tier at and the tick
+        it reached $1,000,000 at (-1 where it never did).
+    Returns a tuple (numpy.ndarray, numpy.ndarray).
+    """
+    configs = len(params['interval'])
+    rows = numpy.arange(configs)
+    tiers = len(TIER_IDS)
+
+    cost = params['cost']
+    income_of = params['income']
+    power_of = params['power']
+    threshold = params['threshold']
+
+    is_power = numpy.zeros(cost.shape[1], dtype=bool)
+    priority = numpy.full(cost.shape[1], -1, dtype=numpy.int64)
+
+    for building_id in BUILDING_IDS:
+        spec = catalog.BUILDINGS[building_id]
+        is_power[building_id] = spec.building_type == simulation.POWER
+
+    # Newer buildings are bought first
+    priority[simulation.HOUSE] = 0
+
+    for tier, building_id in enumerate(TIER_IDS):
+        priority[building_id] = tier + 1
+
+    tier_ids = numpy.array(TIER_IDS, dtype=numpy.int64)
+    tier_power = numpy.array([unlock.power for unlock in simulation.UNLOCKS],
+            dtype=numpy.int64)
+
+    # The game has started: houses are unlocked, and only the abandoned
+    # solar panel has been placed
+    available = numpy.zeros(cost.shape, dtype=bool)
+    available[:, simulation.HOUSE] = True
+
+    income = numpy.zeros(configs, dtype=numpy.int64)
+    power = power_of[:, simulation.SOLAR_PANEL].copy()
+    rate = numpy.zeros(configs, dtype=numpy.int64)
+    placed = numpy.ones(configs, dtype=numpy.int64)
+    next_tier = numpy.zeros(configs, dtype=numpy.int64)
+
+    unlock_ticks = numpy.full((configs, tiers), -1, dtype=numpy.int64)
+    rich_ticks = numpy.full(configs, -1, dtype=numpy.int64)
+
+    for tick in range(1, max_ticks + 1):
+        # Buy one building: the newest income building there is power
+        # for, or else the newest power building there is income for
+        free = (placed < cells + 1)[:, numpy.newaxis]
+
+        income_ok = (available & ~is_power & free &
+                (power[:, numpy.newaxis] >= power_of))
+        power_ok = (available & is_power & free &
+                (income[:, numpy.newaxis] >= cost))
+
+        buy_income = income_ok.any(axis=1)
+        buy = buy_income | power_ok.any(axis=1)
+
+        choice = numpy.where(buy_income,
+                numpy.where(income_ok, priority, -1).argmax(axis=1),
+                numpy.where(power_ok, priority, -1).argmax(axis=1))
+
+        r = rows[buy]
+        b = choice[buy]
+        generator = is_power[b]
+
+        income[r] -= numpy.where(generator, cost[r, b], 0)
+        power[r] += numpy.where(generator, power_of[r, b], -power_of[r, b])
+        rate[r] += income_of[r, b]
+        placed[r] += 1
+
+        # Collect a tick's income, once a building has been placed
+        earning = placed > 1
+        income += numpy.where(earning, rate, 0)
+
+        # Unlock at most one tier
+        tier = numpy.minimum(next_tier, tiers - 1)
+        unlock = (earning & (next_tier < tiers) &
+                (income >= threshold[rows, tier]) &
+                (power >= tier_power[tier]))
+
+        r = rows[unlock]
+        available[r, tier_ids[tier[r]]] = True
+        unlock_ticks[r, tier[r]] = tick
+        next_tier[r] += 1
+
+        rich_ticks[(rich_ticks < 0) & (income >= simulation.RICH)] = tick
+
+        if (next_tier == tiers).all() and (rich_ticks >= 0).all():
+            break
+
+    return (unlock_ticks, rich_ticks)
+
+
+def summarize(ticks, intervals):
+    """
+    ticks: numpy.ndarray
+    intervals: numpy.ndarray
+    Returns a line of statistics of the time the parameter sets took to
+        reach something, in seconds: how many reached it, and the
+        minimum, median, 90th percentile and maximum time of those.
+    Returns a string.
+    """
+    reached = ticks >= 0
+
+    if not reached.any():
+        return "reached by 0 of %d" % len(ticks)
+
+    seconds = ticks[reached] * intervals[reached] / 1000.0
+    low, median, high, top = numpy.percentile(seconds, [0, 50, 90, 100])
+
+    return ("reached by %d of %d: min %.0f s, median %.0f s, p90 %.0f s, "
+            "max %.0f s" % (reached.sum(), len(ticks), low, median, high,
+            top))
+
+
+def write_csv(filename, params, unlock_ticks, rich_ticks):
+    """
+    filename: string
+    params: dict (of numpy.ndarrays)
+    unlock_ticks: numpy.ndarray
+    rich_ticks: numpy.ndarray
+    Writes one row per parameter set: its parameters, then the tick it
+        reached each unlock and $1,000,000 at (-1 if it never did).
+    """
+    keys = [catalog.BUILDINGS[building_id].key
+            for building_id in BUILDING_IDS]
+    unlocked = [catalog.BUILDINGS[building_id].key
+            for building_id in TIER_IDS]
+
+    header = (['config', 'interval'] +
+            ['%s_%s' % (name, key) for name in ('cost', 'income', 'power')
+                for key in keys] +
+            ['threshold_%s' % key for key in unlocked] +
+            ['ticks_%s' % key for key in unlocked] + ['ticks_rich'])
+
+    with open(filename, 'w') as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+
+        for config in range(len(rich_ticks)):
+            writer.writerow([config, params['interval'][config]] +
+                    [params[name][config, building_id]
+                        for name in ('cost', 'income', 'power')
+                        for building_id in BUILDING_IDS] +
+                    list(params['threshold'][config]) +
+                    list(unlock_ticks[config]) + [rich_ticks[config]])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Simulate the economy for "
+            "many sets of balance parameters at once.")
+    parser.add_argument('--configs', type=int, default=10000,
+            help="parameter sets to simulate (default: %(default)s)")
+    parser.add_argument('--spread', type=float, default=0.5,
+            help="largest change to each parameter, as a fraction of "
+            "its current value (default: %(default)s)")
+    parser.add_argument('--seed', type=int, default=0,
+            help="random seed (default: %(default)s)")
+    parser.add_argument('--max-ticks', type=int, default=5000,
+            help="ticks to simulate at most (default: %(default)s)")
+    parser.add_argument('--output', default='sweep.csv',
+            help="file to write results to (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    if numpy is None:
+        print("sweep.py requires NumPy")
+        return 1
+
+    params = sample_parameters(args.configs, args.spread, args.seed)
+
+    start = timeit.default_timer()
+    unlock_ticks, rich_ticks = run(params, args.max_ticks)
+    elapsed = timeit.default_timer() - start
+
+    write_csv(args.output, params, unlock_ticks, rich_ticks)
+
+    intervals = params['interval']
+
+    print("Simulated %d parameter sets in %.2f s" % (args.configs, elapsed))
+    print("Current rules: %s unlocked at tick %s, $1,000,000 at tick %d" %
+            (", ".join(catalog.BUILDINGS[building_id].name.lower()
+                for building_id in TIER_IDS),
+            ", ".join(str(tick) for tick in unlock_ticks[0]),
+            rich_ticks[0]))
+
+    for tier, building_id in enumerate(TIER_IDS):
+        print("%-12s %s" % (catalog.BUILDINGS[building_id].name,
+                summarize(unlock_ticks[:, tier], intervals)))
+
+    print("%-12s %s" % ("$1,000,000", summarize(rich_ticks, intervals)))
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
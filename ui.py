@@ -1,9 +1,18 @@
 import pygame
+from collections import OrderedDict
+import fields
 
 
 class Grid(object):
     """
     A grid object for organizing and displaying pygame data.
+    Each cell holds a building id (0 for an empty cell) rather than a
+        sprite, so a placed building costs one byte instead of a Sprite
+        and its Rect. Cells are drawn by blitting the image for their id,
+        looked up with the images function, straight to the surface.
+    The ids can be kept in a field of the grid's own, or read from a
+        field that is shared with something else (such as the field of
+        a Simulation), so the grid just shows whatever is stored there.
     Attributes:
         width, height: int
         x, y: int
@@ -12,20 +21,28 @@ class Grid(object):
         x_scale, y_scale: int
         color: tuple or list (of ints)
         border: int
-        items: pygame.sprite.Group
-        field: list (of lists)
+        fill: tuple or list (of ints) or None
+        images: function
+        field: fields.ListField, fields.SparseField or fields.MappedField
+        lines: pygame.Surface or None
 
     Methods:
         get_cell((x, y))
         set_cell((x, y), value)
         get_loc((x, y))
         get_pos((x, y))
+        get_rect((x, y))
+        get_bounds()
+        add_building(building_id, (x, y))
         add_sprite(sprite, (x, y))
+        get_lines()
         draw(surface)
+        draw_cell(surface, (x, y))
     """
     def __init__(self, width, height, x=0, y=0, cell_width=50,
             cell_height=50, x_spacing=0, y_spacing=0,
-            color=(0, 0, 0), border=0):
+            color=(0, 0, 0), border=0, fill=None, images=None,
+            sparse=False, field=None):
         self.width = width
         self.height = height
 
@@ -39,36 +56,46 @@ class Grid(object):
         self.y_spacing = y_spacing
 
         self.x_scale = cell_width + x_spacing
-        self.y_scale = cell_width + y_spacing
+        self.y_scale = cell_height + y_spacing
 
         self.color = color
 
         self.border = border
 
-        # Create a sprite group to hold the grid's sprites
-        self.items = pygame.sprite.Group()
+        # Color to clear a cell with before redrawing it, if any
+        self.fill = fill
 
-        # Create a list of length height lists with length width Nones
-        self.field = [[None for j in range(self.width)]
-                for i in range(self.height)]
+        # Function that takes a building id and returns its image
+        self.images = images
+
+        # Show the given field, or create a field of width by height
+        # building ids, one byte each, only storing the occupied chunks of
+        # it if sparse is True
+        if field is not None:
+            self.field = field
+        elif sparse:
+            self.field = fields.SparseField(width, height, typecode='B')
+        else:
+            self.field = fields.ListField(width, height, typecode='B')
+
+        # Layer holding every cell border, rendered on first draw
+        self.lines = None
 
     def get_cell(self, (x, y)):
         """
         (x, y): tuple or list (of ints)
-        Returns the value of the cell at field[y][x].
-        Note: A row (y) is a list of cells, while a column (x) is a value.
-        Returns an object or None.
+        Returns the building id at column x, row y (0 if it is empty).
+        Returns an int.
         """
-        return self.field[y][x]
+        return self.field.get(x, y)
 
     def set_cell(self, (x, y), value):
         """
         (x, y): tuple or list (of ints)
-        value: any object (usually int, None, or pygame.sprite.Sprite)
-        Sets the value of the cell at field[y][x] to the given value.
-        Note: A row(y) is a list of cells, while a column (x) is a value.
+        value: int
+        Sets the value of the cell at column x, row y to the given value.
         """
-        self.field[y][x] = value
+        self.field.set(x, y, value)
 
     def get_loc(self, (x, y)):
         """
@@ -80,27 +107,16 @@ class Grid(object):
         if x < self.x or y < self.y:
             return None
 
-        x_max = self.x + self.width * self.x_scale
-        y_max = self.y + self.height * self.y_scale
+        # Nearest grid cell to the left of (and above) the position, and
+        # how far into that cell the position is
+        grid_x, offset_x = divmod(x - self.x, self.x_scale)
+        grid_y, offset_y = divmod(y - self.y, self.y_scale)
 
-        if x >= x_max or y >= y_max:
+        if grid_x >= self.width or grid_y >= self.height:
             return None
 
-        # Subtract grid starting position to get correct alignment
-        grid_x = x - self.x
-        grid_y = y - self.y
-
-        # Round to the nearest grid cell to the left of the position
-        grid_x /= self.x_scale
-        grid_y /= self.y_scale
-
-        # Lists of pixels that that overlap with the nearest cell to the left
-        x_range = range(self.x + grid_x * self.x_scale,
-                self.x + grid_x * self.x_scale + self.cell_width)
-        y_range = range(self.y + grid_y * self.y_scale,
-                self.y + grid_y * self.y_scale + self.cell_height)
-
-        if x not in x_range or y not in y_range:
+        # Positions in the spacing between cells aren't in any cell
+        if offset_x >= self.cell_width or offset_y >= self.cell_height:
             return None
 
         return (grid_x, grid_y)
@@ -116,35 +132,75 @@ class Grid(object):
 
         return (x, y)
 
+    def get_rect(self, (x, y)):
+        """
+        (x, y): tuple or list (of ints)
+        Returns the pixel area covered by the cell at grid coordinates (x, y).
+        Returns a pygame.Rect object.
+        """
+        return pygame.Rect(self.get_pos((x, y)),
+                (self.cell_width, self.cell_height))
+
+    def get_bounds(self):
+        """
+        Returns the pixel area covered by the whole grid.
+        Returns a pygame.Rect object.
+        """
+        return pygame.Rect(self.x, self.y,
+                self.width * self.x_scale - self.x_spacing,
+                self.height * self.y_scale - self.y_spacing)
+
+    def add_building(self, building_id, (x, y)):
+        """
+        building_id: int
+        (x, y): tuple or list (of ints)
+        Puts a building id in the cell at grid coordinates (x, y).
+        Only works if the cell is empty (set to 0).
+        Returns True if the building was added.
+        Returns a bool.
+        """
+        if self.get_cell((x, y)):
+            return False
+
+        self.set_cell((x, y), building_id)
+
+        return True
+
     def add_sprite(self, sprite, (x, y)):
         """
-        sprite: pygame.sprite.Sprite
+        sprite: buildings.Building
         (x, y): tuple or list (of ints)
-        Adds a sprite to the items group and sets its Rect position.
-        Only works if the cell is empty (set to None).
-        Puts the cell in the field list.
+        Adds the sprite's building to the cell at grid coordinates (x, y)
+            and moves the sprite's Rect onto the cell.
+        The grid only keeps the building id, not the sprite.
+        Returns True if the building was added.
+        Returns a bool.
         """
-        if self.get_cell((x, y)) is None:
-            self.set_cell((x, y), sprite)
+        if not self.add_building(sprite.building_id, (x, y)):
+            return False
 
-            sprite.rect.left = self.get_pos((x, y))[0]
-            sprite.rect.top = self.get_pos((x, y))[1]
+        sprite.rect.topleft = self.get_pos((x, y))
 
-            self.items.add(sprite)
+        return True
 
-    def draw(self, surface):
+    def get_lines(self):
         """
-        surface: pygame.Surface object
-        Draws each of the sprites in the items group.
-        Draws grid to the specified surface using a Rect object.
+        Returns a transparent layer the size of the grid with every cell
+            border drawn on it, relative to the grid's position.
+        The layer is only drawn the first time it is needed.
+        Returns a pygame.Surface object.
         """
-        self.items.draw(surface)
+        if self.lines is not None:
+            return self.lines
+
+        self.lines = pygame.Surface((self.width * self.x_scale,
+                self.height * self.y_scale), pygame.SRCALPHA)
 
-        cell = pygame.Rect(self.x, self.y, self.cell_width, self.cell_height)
+        cell = pygame.Rect(0, 0, self.cell_width, self.cell_height)
 
         for row in range(self.height):
             for column in range(self.width):
-                pygame.draw.rect(surface, self.color, cell, self.border)
+                pygame.draw.rect(self.lines, self.color, cell, self.border)
 
                 # Move cell to next grid location in row
                 cell = cell.move(self.x_scale, 0)
@@ -152,6 +208,389 @@ class Grid(object):
             # Move cell back to left edge of grid and down one row
             cell = cell.move(-self.width * self.x_scale, self.y_scale)
 
+        if pygame.display.get_surface() is not None:
+            self.lines = self.lines.convert_alpha()
+
+        return self.lines
+
+    def draw(self, surface):
+        """
+        surface: pygame.Surface object
+        Draws the image of every occupied cell.
+        Draws grid to the specified surface using the cached border layer.
+        """
+        images = self.images
+        get_pos = self.get_pos
+
+        for x, y, building_id in self.field.occupied():
+            surface.blit(images(building_id), get_pos((x, y)))
+
+        surface.blit(self.get_lines(), (self.x, self.y))
+
+    def draw_cell(self, surface, (x, y)):
+        """
+        surface: pygame.Surface object
+        (x, y): tuple or list (of ints)
+        Redraws only the cell at grid coordinates (x, y): clears it with
+            the fill color (if there is one), then draws its building and
+            its border.
+        Returns the pygame.Rect that was drawn.
+        """
+        rect = self.get_rect((x, y))
+
+        if self.fill is not None:
+            surface.fill(self.fill, rect)
+
+        building_id = self.get_cell((x, y))
+
+        if building_id:
+            surface.blit(self.images(building_id), rect)
+
+        surface.blit(self.get_lines(), rect, rect.move(-self.x, -self.y))
+
+        return rect
+
+
+class ScrollingGrid(Grid):
+    """
+    A grid that is larger than the area it is shown in.
+    A camera (a pixel offset into the grid) picks which part of the grid
+        is visible in the view. The grid is split into square chunks of
+        cells that are rendered once and reused while they stay among the
+        max_chunks most recently drawn, so drawing costs (and the memory
+        the rendered chunks take) depend on the size of the view rather
+        than the size of the grid.
+    x and y are the position of the view on the screen, and get_pos and
+        get_loc take the camera into account.
+    Attributes:
+        (all Grid attributes)
+        view: pygame.Rect
+        camera_x, camera_y: int
+        chunk_size: int
+        max_chunks: int
+        chunks: OrderedDict (of pygame.Surfaces)
+
+    Methods:
+        (all Grid methods)
+        get_bounds()
+        set_camera((x, y))
+        move_camera((dx, dy))
+        get_chunk((column, row))
+    """
+    def __init__(self, width, height, view_width, view_height,
+            chunk_size=16, max_chunks=None, **kwargs):
+        Grid.__init__(self, width, height, **kwargs)
+
+        self.view = pygame.Rect(self.x, self.y, view_width, view_height)
+
+        self.camera_x = 0
+        self.camera_y = 0
+
+        self.chunk_size = chunk_size
+
+        # By default, keep enough chunks to cover the view wherever the
+        # camera is, plus one more column and row of them so panning back
+        # and forth over a chunk edge doesn't render the same chunks again
+        if max_chunks is None:
+            columns = -(-view_width // (chunk_size * self.x_scale)) + 2
+            rows = -(-view_height // (chunk_size * self.y_scale)) + 2
+            max_chunks = columns * rows
+
+        self.max_chunks = max_chunks
+
+        # Rendered chunks by (column, row), least recently drawn first
+        self.chunks = OrderedDict()
+
+    def get_loc(self, (x, y)):
+        """
+        (x, y): tuple or list (of ints)
+        Returns a tuple of grid coordinates that correspond to screen
+            position (x, y).
+        Returns None if the position is outside the view or not in a cell.
+        Returns a tuple or None.
+        """
+        if not self.view.collidepoint(x, y):
+            return None
+
+        return Grid.get_loc(self, (x + self.camera_x, y + self.camera_y))
+
+    def get_pos(self, (x, y)):
+        """
+        (x, y): tuple or list (of ints)
+        Takes a set of grid coordinates and returns their screen position
+            for the current camera.
+        Returns a tuple.
+        """
+        x = self.x + x * self.x_scale - self.camera_x
+        y = self.y + y * self.y_scale - self.camera_y
+
+        return (x, y)
+
+    def get_bounds(self):
+        """
+        Returns the pixel area of the view.
+        Returns a pygame.Rect object.
+        """
+        return self.view.copy()
+
+    def set_camera(self, (x, y)):
+        """
+        (x, y): tuple or list (of ints)
+        Moves the camera to pixel offset (x, y) into the grid, keeping
+            the view inside the grid.
+        Returns True if the camera moved.
+        Returns a bool.
+        """
+        x = max(0, min(x, self.width * self.x_scale - self.view.width))
+        y = max(0, min(y, self.height * self.y_scale - self.view.height))
+
+        if (x, y) == (self.camera_x, self.camera_y):
+            return False
+
+        self.camera_x = x
+        self.camera_y = y
+
+        return True
+
+    def move_camera(self, (dx, dy)):
+        """
+        (dx, dy): tuple or list (of ints)
+        Moves the camera by (dx, dy) pixels.
+        Returns True if the camera moved.
+        Returns a bool.
+        """
+        return self.set_camera((self.camera_x + dx, self.camera_y + dy))
+
+    def get_chunk(self, (column, row)):
+        """
+        (column, row): tuple or list (of ints)
+        Returns the rendered chunk at the given chunk coordinates,
+            rendering it if it isn't cached. The least recently used
+            chunks are dropped once there are more than max_chunks.
+        Returns a pygame.Surface object.
+        """
+        key = (column, row)
+        chunk = self.chunks.pop(key, None)
+
+        if chunk is None:
+            chunk = self.render_chunk(key)
+
+            if len(self.chunks) >= self.max_chunks:
+                self.chunks.popitem(last=False)
+
+        self.chunks[key] = chunk
+
+        return chunk
+
+    def render_chunk(self, (column, row)):
+        """
+        (column, row): tuple or list (of ints)
+        Draws the cells, buildings and borders of one chunk.
+        Returns a pygame.Surface object.
+        """
+        size = self.chunk_size
+
+        first_x = column * size
+        first_y = row * size
+        columns = min(size, self.width - first_x)
+        rows = min(size, self.height - first_y)
+
+        chunk = pygame.Surface((columns * self.x_scale, rows * self.y_scale))
+
+        if pygame.display.get_surface() is not None:
+            chunk = chunk.convert()
+
+        chunk.fill(self.fill or (0, 0, 0))
+
+        for y in range(rows):
+            for x in range(columns):
+                self.render_cell(chunk, (x, y), (first_x + x, first_y + y))
+
+        return chunk
+
+    def render_cell(self, chunk, (x, y), loc):
+        """
+        chunk: pygame.Surface
+        (x, y): tuple or list (of ints)
+        loc: tuple or list (of ints)
+        Draws the cell at grid coordinates loc into its chunk, at cell
+            (x, y) within the chunk.
+        """
+        cell = pygame.Rect(x * self.x_scale, y * self.y_scale,
+                self.cell_width, self.cell_height)
+
+        chunk.fill(self.fill or (0, 0, 0), cell)
+
+        building_id = self.get_cell(loc)
+
+        if building_id:
+            chunk.blit(self.images(building_id), cell)
+
+        pygame.draw.rect(chunk, self.color, cell, self.border)
+
+    def draw(self, surface):
+        """
+        surface: pygame.Surface object
+        Draws the part of the grid inside the view, one chunk at a time.
+        Only chunks that overlap the view and have cells in them are
+            drawn.
+        """
+        chunk_width = self.chunk_size * self.x_scale
+        chunk_height = self.chunk_size * self.y_scale
+
+        first_column = self.camera_x // chunk_width
+        first_row = self.camera_y // chunk_height
+
+        # A grid smaller than the view has no chunks past its last cells
+        last_column = min((self.camera_x + self.view.width - 1) //
+                chunk_width, (self.width - 1) // self.chunk_size)
+        last_row = min((self.camera_y + self.view.height - 1) //
+                chunk_height, (self.height - 1) // self.chunk_size)
+
+        clip = surface.get_clip()
+        surface.set_clip(self.view)
+
+        if self.fill is not None:
+            surface.fill(self.fill, self.view)
+
+        for row in range(first_row, last_row + 1):
+            for column in range(first_column, last_column + 1):
+                pos = (self.x + column * chunk_width - self.camera_x,
+                        self.y + row * chunk_height - self.camera_y)
+
+                surface.blit(self.get_chunk((column, row)), pos)
+
+        surface.set_clip(clip)
+
+    def draw_cell(self, surface, (x, y)):
+        """
+        surface: pygame.Surface object
+        (x, y): tuple or list (of ints)
+        Redraws only the cell at grid coordinates (x, y), both in its
+            cached chunk (if there is one) and in the view.
+        Returns the pygame.Rect of the screen that was drawn.
+        """
+        size = self.chunk_size
+        key = (x // size, y // size)
+
+        chunk = self.chunks.get(key)
+
+        if chunk is not None:
+            self.render_cell(chunk, (x % size, y % size), (x, y))
+
+        rect = self.get_rect((x, y)).clip(self.view)
+
+        if rect.width and rect.height:
+            chunk = self.get_chunk(key)
+            area = pygame.Rect(rect.x - self.x + self.camera_x
+                    - key[0] * size * self.x_scale,
+                    rect.y - self.y + self.camera_y
+                    - key[1] * size * self.y_scale,
+                    rect.width, rect.height)
+
+            surface.blit(chunk, rect, area)
+
+        return rect
+
+
+class HitRegistry(object):
+    """
+    Maps screen positions to the UI regions (grids, panels, etc.) under
+        them.
+    The screen is split into square buckets, each listing the regions
+        that overlap it, so a lookup only checks the regions near the
+        position no matter how many are registered.
+    Attributes:
+        width, height: int
+        bucket_size: int
+        columns, rows: int
+        buckets: list (of lists)
+        regions: dict
+
+    Methods:
+        register(name, rect, region=None)
+        unregister(name)
+        resolve((x, y))
+    """
+    def __init__(self, width, height, bucket_size=50):
+        self.width = width
+        self.height = height
+
+        self.bucket_size = bucket_size
+        self.columns = (width + bucket_size - 1) // bucket_size
+        self.rows = (height + bucket_size - 1) // bucket_size
+
+        # Lists of (name, rect, region), one per bucket, row by row
+        self.buckets = [[] for i in range(self.columns * self.rows)]
+
+        self.regions = {}
+
+    def register(self, name, rect, region=None):
+        """
+        name: string
+        rect: pygame.Rect or tuple (of ints)
+        region: object with a get_loc((x, y)) method (such as a Grid),
+            or None
+        Registers a region covering rect under the given name, replacing
+            any region already registered under that name.
+        Regions registered later are on top of earlier ones.
+        """
+        self.unregister(name)
+
+        rect = pygame.Rect(rect)
+        entry = (name, rect, region)
+        self.regions[name] = entry
+
+        clipped = rect.clip((0, 0, self.width, self.height))
+        size = self.bucket_size
+
+        if clipped.width == 0 or clipped.height == 0:
+            return
+
+        for row in range(clipped.top // size,
+                (clipped.bottom - 1) // size + 1):
+            for column in range(clipped.left // size,
+                    (clipped.right - 1) // size + 1):
+                self.buckets[row * self.columns + column].append(entry)
+
+    def unregister(self, name):
+        """
+        name: string
+        Removes the region registered under the given name, if any.
+        """
+        entry = self.regions.pop(name, None)
+
+        if entry is None:
+            return
+
+        for bucket in self.buckets:
+            if entry in bucket:
+                bucket.remove(entry)
+
+    def resolve(self, (x, y)):
+        """
+        (x, y): tuple or list (of ints)
+        Finds the topmost region under position (x, y).
+        The cell is the result of the region's get_loc((x, y)), or None
+            if the region has no cells.
+        Returns a tuple (name, cell) or None if no region is there.
+        """
+        if x < 0 or y < 0 or x >= self.width or y >= self.height:
+            return None
+
+        size = self.bucket_size
+        bucket = self.buckets[(y // size) * self.columns + x // size]
+
+        # Latest registered first, without copying the bucket
+        for name, rect, region in reversed(bucket):
+            if rect.collidepoint(x, y):
+                if region is None:
+                    return (name, None)
+
+                return (name, region.get_loc((x, y)))
+
+        return None
+
 
 class StatusBar(object):
     """
@@ -168,8 +607,10 @@ class StatusBar(object):
     Methods:
         set_status(text)
         get_income()
+        set_income(x)
         change_income(x)
         get_power()
+        set_power(x)
         change_power(x)
         set_game_over(text)
         draw_labels(surface)
@@ -204,16 +645,23 @@ class StatusBar(object):
         """
         return self.income_total
 
-    def change_income(self, x):
+    def set_income(self, x):
         """
         x: int
-        Changes the current income total by x (can be negative).
+        Sets the displayed income total to x.
         Uses make_string to add commas
         """
-        self.income_total += x
+        self.income_total = x
         income = "$" + make_string(self.income_total)
         self.income.set_text(income, align="right")
 
+    def change_income(self, x):
+        """
+        x: int
+        Changes the current income total by x (can be negative).
+        """
+        self.set_income(self.income_total + x)
+
     def get_power(self):
         """
         Returns the current total power.
@@ -221,16 +669,23 @@ class StatusBar(object):
         """
         return self.power_total
 
-    def change_power(self, x):
+    def set_power(self, x):
         """
         x: int
-        Changes the current power total by x (can be negative).
+        Sets the displayed power total to x.
         Uses make_string to add commas.
         """
-        self.power_total += x
+        self.power_total = x
         power = make_string(self.power_total)
         self.power.set_text(power, align="left")
 
+    def change_power(self, x):
+        """
+        x: int
+        Changes the current power total by x (can be negative).
+        """
+        self.set_power(self.power_total + x)
+
     def set_game_over(self, text):
         """
         text: string
@@ -265,8 +720,11 @@ class StatusBar(object):
 class Font(object):
     """
     A font object for storing and positioning text.
+    Fonts of the same file and size share one pygame.font.Font, and
+        fonts of the same file, size and color share one TextCache.
     Attributes:
         font: pygame.font.Font
+        cache: TextCache
         fixed_pos: tuple or list (of ints)
         value: pygame.Surface
         pos: pygame.Rect
@@ -274,11 +732,12 @@ class Font(object):
         color: tuple or list (of ints)
     """
     def __init__(self, font, size, color, pos):
-        self.font = pygame.font.Font(font, size)
+        self.font = get_font(font, size)
+        self.cache = get_text_cache(font, size, color)
 
         self.fixed_pos = pos
 
-        self.value = self.font.render("", True, color)
+        self.value = self.cache.render("")
         self.pos = self.value.get_rect()
         self.old_pos = self.pos
 
@@ -296,7 +755,7 @@ class Font(object):
         The positions used for alignment are stored in fixed_pos.
         """
         self.old_pos = self.pos
-        self.value = self.font.render(text, True, self.color)
+        self.value = self.cache.render(text)
         self.pos = self.value.get_rect()
 
         if align == "left":
@@ -330,6 +789,319 @@ class Font(object):
         return self.old_pos
 
 
+class TextCache(object):
+    """
+    A bounded cache of rendered text for one font and color.
+    Numbers (digits, commas, dollar and minus signs) are built from
+        individually cached glyphs instead of being rendered whole.
+    The least recently used text is dropped once the cache is full.
+    Attributes:
+        font: pygame.font.Font
+        color: tuple or list (of ints)
+        max_size: int
+        glyphs: dict (of pygame.Surfaces)
+        texts: OrderedDict (of pygame.Surfaces)
+        hits, misses: int
+
+    Methods:
+        render(text)
+        render_number(text)
+    """
+    # Characters that are drawn from the glyph cache
+    numeric = frozenset("0123456789,$-")
+
+    def __init__(self, font, color, max_size=64):
+        self.font = font
+        self.color = color
+        self.max_size = max_size
+
+        self.glyphs = {}
+        self.texts = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+
+    def render(self, text):
+        """
+        text: string
+        Returns the given text rendered in the cache's font and color.
+        The returned Surface is shared and should not be drawn on.
+        Returns a pygame.Surface object.
+        """
+        value = self.texts.pop(text, None)
+
+        if value is not None:
+            self.hits += 1
+
+        else:
+            self.misses += 1
+
+            if text and self.numeric.issuperset(text):
+                value = self.render_number(text)
+            else:
+                value = self.font.render(text, True, self.color)
+
+            if len(self.texts) >= self.max_size:
+                self.texts.popitem(last=False)
+
+        # Most recently used text goes last
+        self.texts[text] = value
+
+        return value
+
+    def render_number(self, text):
+        """
+        text: string
+        Builds the given text out of cached glyphs, rendering any glyph
+            that hasn't been seen yet.
+        Returns a pygame.Surface object.
+        """
+        glyphs = []
+        width = 0
+
+        for char in text:
+            glyph = self.glyphs.get(char)
+
+            if glyph is None:
+                glyph = self.font.render(char, True, self.color)
+                self.glyphs[char] = glyph
+
+            glyphs.append(glyph)
+            width += glyph.get_width()
+
+        height = max(glyph.get_height() for glyph in glyphs)
+
+        placements = []
+        x = 0
+
+        for glyph in glyphs:
+            placements.append((glyph, (x, 0)))
+            x += glyph.get_width()
+
+        return pack_images((width, height), placements)
+
+
+# pygame.font.Fonts by (file, size), and TextCaches by (file, size, color)
+_fonts = {}
+_text_caches = {}
+
+
+def get_font(font, size):
+    """
+    font: string or None
+    size: int
+    Returns the shared pygame.font.Font for the given file and size,
+        loading it the first time it is asked for.
+    Returns a pygame.font.Font object.
+    """
+    key = (font, size)
+
+    if key not in _fonts:
+        _fonts[key] = pygame.font.Font(font, size)
+
+    return _fonts[key]
+
+
+def get_text_cache(font, size, color):
+    """
+    font: string or None
+    size: int
+    color: tuple or list (of ints)
+    Returns the shared TextCache for the given file, size and color.
+    Returns a TextCache object.
+    """
+    key = (font, size, tuple(color))
+
+    if key not in _text_caches:
+        _text_caches[key] = TextCache(get_font(font, size), color)
+
+    return _text_caches[key]
+
+
+class Compositor(object):
+    """
+    Collects the parts of the screen that change during a frame and
+        copies just those parts from the background to the screen once
+        per frame.
+    The background is drawn with its top left corner at pos on the
+        screen; dirty rects are in screen coordinates.
+    Attributes:
+        screen: pygame.Surface
+        background: pygame.Surface
+        pos: tuple or list (of ints)
+        dirty: list (of pygame.Rects)
+        frames: int
+        updates: int
+        pixels: int
+        frame_pixels: int
+        frame_blits: int
+
+    Methods:
+        add(rect)
+        add_all()
+        discard()
+        flush(overlay=None)
+    """
+    def __init__(self, screen, background, pos=(0, 0)):
+        self.screen = screen
+        self.background = background
+        self.pos = pos
+
+        self.dirty = []
+
+        # Counters for frames pushed, rects updated on the display and
+        # pixels pushed
+        self.frames = 0
+        self.updates = 0
+        self.pixels = 0
+        self.frame_pixels = 0
+        self.frame_blits = 0
+
+    def add(self, rect):
+        """
+        rect: pygame.Rect or tuple (of ints)
+        Marks a part of the screen as needing to be redrawn this frame.
+        """
+        self.dirty.append(pygame.Rect(rect))
+
+    def add_all(self):
+        """
+        Marks the whole screen as needing to be redrawn this frame.
+        """
+        self.add(self.screen.get_rect())
+
+    def discard(self):
+        """
+        Forgets the parts of the screen marked this frame without
+            redrawing them, for when nothing is shown (such as a replay).
+        """
+        del self.dirty[:]
+
+    def flush(self, overlay=None):
+        """
+        overlay: pygame.sprite.Group or None
+        Redraws the dirty parts of the screen from the background,
+            draws the overlay sprites (such as the mouse sprite) on top
+            and updates the display once.
+        Does nothing if nothing has changed this frame.
+        Returns the list of pygame.Rects that were updated.
+        """
+        self.frame_pixels = 0
+        self.frame_blits = 0
+
+        if not self.dirty:
+            return []
+
+        # Sprites on top of the background have to be redrawn wherever
+        # the background under them is restored
+        if overlay is not None:
+            for sprite in overlay:
+                self.dirty.append(sprite.rect.copy())
+
+        rects = merge_rects(self.dirty, self.screen.get_rect())
+        self.dirty = []
+
+        for rect in rects:
+            area = rect.move(-self.pos[0], -self.pos[1])
+            self.screen.blit(self.background, rect, area)
+            self.frame_pixels += rect.width * rect.height
+
+        self.frame_blits = len(rects)
+
+        if overlay is not None:
+            overlay.draw(self.screen)
+            self.frame_blits += len(overlay)
+
+        pygame.display.update(rects)
+
+        self.frames += 1
+        self.updates += len(rects)
+        self.pixels += self.frame_pixels
+
+        return rects
+
+
+def merge_rects(rects, bounds):
+    """
+    rects: list (of pygame.Rects)
+    bounds: pygame.Rect
+    Clips each rect to bounds and merges any rects that overlap into
+        their union, so no pixel is redrawn twice.
+    Returns a list (of pygame.Rects).
+    """
+    merged = []
+
+    for rect in rects:
+        rect = rect.clip(bounds)
+
+        if rect.width == 0 or rect.height == 0:
+            continue
+
+        # Absorb every merged rect this one touches; the union can
+        # touch rects that the original didn't, so check again
+        i = rect.collidelist(merged)
+
+        while i != -1:
+            rect.union_ip(merged.pop(i))
+            i = rect.collidelist(merged)
+
+        merged.append(rect)
+
+    return merged
+
+
+def line_cells((x0, y0), (x1, y1)):
+    """
+    (x0, y0): tuple or list (of ints)
+    (x1, y1): tuple or list (of ints)
+    Returns the grid cells on a straight line between two cells, both
+        included, with no gaps (such as between two samples of a fast
+        mouse drag).
+    Returns a list (of tuples).
+    """
+    steps = max(abs(x1 - x0), abs(y1 - y0))
+
+    if steps == 0:
+        return [(x0, y0)]
+
+    return [(int(round(x0 + (x1 - x0) * i / float(steps))),
+            int(round(y0 + (y1 - y0) * i / float(steps))))
+            for i in range(steps + 1)]
+
+
+def rect_cells((x0, y0), (x1, y1)):
+    """
+    (x0, y0): tuple or list (of ints)
+    (x1, y1): tuple or list (of ints)
+    Returns every grid cell of the rectangle with the two cells at
+        opposite corners, row by row.
+    Returns a list (of tuples).
+    """
+    return [(x, y)
+            for y in range(min(y0, y1), max(y0, y1) + 1)
+            for x in range(min(x0, x1), max(x0, x1) + 1)]
+
+
+def pack_images(size, placements):
+    """
+    size: tuple or list (of ints)
+    placements: list (of tuples (pygame.Surface, position))
+    Copies each image onto a new transparent surface of the given size
+        at its position, keeping every pixel (alpha included) exactly as
+        it was, such as to pack glyphs into a line of text or images
+        into an atlas.
+    Returns a pygame.Surface object.
+    """
+    surface = pygame.Surface(size, pygame.SRCALPHA)
+
+    # BLEND_RGBA_MAX onto a transparent surface copies pixels exactly,
+    # where a normal blit would blend their alpha with the surface's
+    for image, pos in placements:
+        surface.blit(image, pos, special_flags=pygame.BLEND_RGBA_MAX)
+
+    return surface
+
+
 def make_string(number):
     """
     number: int or string